@@ -1,10 +1,11 @@
 import os
-import sqlite3
-import uuid
-import subprocess
-import requests
-from bs4 import BeautifulSoup
-from ebooklib import epub
+from html import escape
+from ratelimit import HostRateLimiter, polite_get
+from storage import connect, compress_html, decompress_html
+from epub_writer import EpubWriter
+from calibre_sync import sync_epubs
+from fulltext import create_index, index_statement
+from cleaner import HtmlCleaner, parse_document, select_one, outer_html, html_to_text
 
 # Establish the persistent path in ~/github/knowledge
 BASE_DIR = os.path.expanduser("~/github/knowledge")
@@ -14,9 +15,18 @@ DB_PATH = os.path.join(BASE_DIR, "articles_digest.db")
 EPUB_PATH = os.path.join(BASE_DIR, "articles_digest.epub")
 CALIBRE_BOOK_TITLE = "My Web Articles Digest"
 
+# Per-host pacing shared with the crawler's saved limits
+LIMITER = HostRateLimiter()
+
+# Sidebars, maps, infoboxes, TOC, edit links and references
+WIKIPEDIA_CLEANER = HtmlCleaner([
+    ".infobox", ".vertical-navbox", ".thumb", ".floatright", ".metadata",
+    "#toc", ".toc", ".mw-editsection", ".reference"
+])
+
 def init_db():
     """Initializes the database inside the designated directory."""
-    with sqlite3.connect(DB_PATH) as conn:
+    with connect(DB_PATH) as conn:
         conn.execute("""
             CREATE TABLE IF NOT EXISTS articles (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -26,50 +36,45 @@ def init_db():
                 added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         """)
+        # Full-text index of article text, searched with fulltext.py
+        create_index(conn, "articles")
 
 def fetch_wikipedia_article(url):
     """Custom extractor to strip Wikipedia-specific clutter for e-readers."""
     headers = {'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64)'}
-    response = requests.get(url, headers=headers)
+    response = polite_get(LIMITER, url, headers=headers, timeout=30)
     response.raise_for_status()
     
-    soup = BeautifulSoup(response.text, 'html.parser')
+    doc = parse_document(response.content)
     
-    title_tag = soup.find('h1', id='firstHeading') or soup.find('h1') or soup.find('title')
-    title = title_tag.get_text().strip() if title_tag else "Untitled Wikipedia Article"
+    title_tag = select_one(doc, 'h1#firstHeading', 'h1', 'title')
+    title = title_tag.text_content().strip() if title_tag is not None else "Untitled Wikipedia Article"
     
-    content_block = soup.select_one('#mw-content-text .mw-parser-output')
-    if not content_block:
+    content_block = select_one(doc, '#mw-content-text .mw-parser-output')
+    if content_block is None:
         raise ValueError("Could not extract main Wikipedia content block.")
         
-    # Drop sidebars, maps, infoboxes, and references
-    for element in content_block.select('.infobox, .vertical-navbox, .thumb, .floatright, .metadata'):
-        element.decompose()
-    for toc in content_block.select('#toc, .toc'):
-        toc.decompose()
-    for edit_section in content_block.select('.mw-editsection'):
-        edit_section.decompose()
-    for ref in content_block.select('.reference'):
-        ref.decompose()
-
-    clean_html = f"<html><body><h1>{title}</h1>{content_block.prettify()}</body></html>"
+    # Drop sidebars, maps, infoboxes, TOC, edit links and references in one pass
+    WIKIPEDIA_CLEANER.clean_tree(content_block)
+
+    clean_html = f"<html><body><h1>{escape(title)}</h1>{outer_html(content_block)}</body></html>"
     return title, clean_html
 
 def fetch_generic_article(url, selector):
     """Standard fallback extractor for general blogs and websites."""
     headers = {'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64)'}
-    response = requests.get(url, headers=headers)
+    response = polite_get(LIMITER, url, headers=headers, timeout=30)
     response.raise_for_status()
     
-    soup = BeautifulSoup(response.text, 'html.parser')
-    title_tag = soup.find('h1') or soup.find('title')
-    title = title_tag.get_text().strip() if title_tag else "Untitled Article"
+    doc = parse_document(response.content)
+    title_tag = select_one(doc, 'h1', 'title')
+    title = title_tag.text_content().strip() if title_tag is not None else "Untitled Article"
     
-    content_block = soup.select_one(selector)
-    if not content_block:
+    content_block = select_one(doc, selector)
+    if content_block is None:
         raise ValueError(f"Could not find content with selector: '{selector}'")
         
-    clean_html = f"<html><body><h1>{title}</h1>{content_block.prettify()}</body></html>"
+    clean_html = f"<html><body><h1>{escape(title)}</h1>{outer_html(content_block)}</body></html>"
     return title, clean_html
 
 def fetch_and_store(url, selector=None):
@@ -77,7 +82,7 @@ def fetch_and_store(url, selector=None):
     and prevents duplicates.
     """
     # Check if the URL is already tracking in our database to skip request overhead entirely
-    with sqlite3.connect(DB_PATH) as conn:
+    with connect(DB_PATH) as conn:
         cursor = conn.execute("SELECT title FROM articles WHERE url = ?", (url,))
         existing = cursor.fetchone()
         if existing:
@@ -101,8 +106,7 @@ def fetch_and_store(url, selector=None):
                 title, html_content = fetch_generic_article(url, selector)
                 
                 # Preview logic
-                soup = BeautifulSoup(html_content, 'html.parser')
-                text_preview = soup.get_text().strip()
+                text_preview = html_to_text(html_content).strip()
                 print("\n" + "="*40)
                 print(f"PREVIEW (Title: {title})")
                 print("-" * 40)
@@ -125,82 +129,38 @@ def fetch_and_store(url, selector=None):
                 if confirm_retry != 'y':
                     return False
     
-    with sqlite3.connect(DB_PATH) as conn:
+    with connect(DB_PATH) as conn:
         conn.execute(
             "INSERT INTO articles (url, title, html_content) VALUES (?, ?, ?)",
-            (url, title, html_content)
+            (url, title, compress_html(DB_PATH, html_content, "articles"))
         )
+        conn.execute(*index_statement("articles", title, html_content, url))
         print(f"Stored successfully: {title}")
         return True
 
 def compile_epub_from_db():
-    """Rebuilds the entire EPUB structure fresh from SQLite records."""
+    """Rebuilds the entire EPUB structure fresh from SQLite records.
+
+    Articles are streamed from the cursor straight into the archive, so only
+    the table of contents is held in memory.
+    """
     print("Compiling fresh EPUB archive from database records...")
-    book = epub.EpubBook()
-    book.set_identifier("web_digest_master_archive")
-    book.set_title(CALIBRE_BOOK_TITLE)
-    book.set_language("en")
-    book.add_author("Article Scraper Pipeline")
-
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.execute("SELECT id, title, html_content FROM articles ORDER BY id ASC")
-        rows = cursor.fetchall()
-
-    if not rows:
-        print("No articles found in database to compile.")
-        return False
-
-    spine = ['nav']
-    for row_id, title, html_content in rows:
-        file_name = f"article_{row_id}.xhtml"
-        chapter = epub.EpubHtml(title=title, file_name=file_name, lang='en')
-        chapter.content = html_content
-        
-        book.add_item(chapter)
-        book.toc.append(chapter)
-        spine.append(chapter)
+    with connect(DB_PATH) as conn:
+        count = conn.execute("SELECT COUNT(*) FROM articles").fetchone()[0]
+        if not count:
+            print("No articles found in database to compile.")
+            return False
 
-    book.spine = spine
-    book.add_item(epub.EpubNcx())
-    book.add_item(epub.EpubNav())
-    
-    if os.path.exists(EPUB_PATH):
-        os.remove(EPUB_PATH)
-        
-    epub.write_epub(EPUB_PATH, book)
-    print(f"New clean EPUB generated with {len(rows)} chapters at: {EPUB_PATH}")
+        with EpubWriter(EPUB_PATH, CALIBRE_BOOK_TITLE, "web_digest_master_archive", "Article Scraper Pipeline") as writer:
+            for row_id, title, html_content in conn.execute("SELECT id, title, html_content FROM articles ORDER BY id ASC"):
+                writer.add_chapter(f"article_{row_id}.xhtml", title, decompress_html(DB_PATH, html_content))
+
+    print(f"New clean EPUB generated with {count} chapters at: {EPUB_PATH}")
     return True
 
 def sync_with_calibre():
-    """Forces Calibre catalog engine to pick up binary file layout shifts."""
-    print("Syncing updated EPUB format with Calibre library...")
-    try:
-        search_cmd = ["calibredb", "search", f"title:\"{CALIBRE_BOOK_TITLE}\""]
-        result = subprocess.run(search_cmd, capture_output=True, text=True, check=True)
-        book_ids = result.stdout.strip()
-
-        if book_ids:
-            book_id = book_ids.split(',')[0]
-            print(f"Updating existing Calibre Book Entry ID: {book_id}")
-            add_cmd = ["calibredb", "add_format", book_id, EPUB_PATH]
-            subprocess.run(add_cmd, check=True)
-        else:
-            print("Adding digest to Calibre as a brand new catalog item...")
-            add_cmd = ["calibredb", "add", EPUB_PATH]
-            subprocess.run(add_cmd, check=True)
-            
-        print("Calibre database successfully refreshed.")
-    except FileNotFoundError:
-        print("\n[Warning]: 'calibredb' command utility was not found in system PATH.")
-        print("Compilation complete, but automated Calibre indexing skipped.")
-    except subprocess.CalledProcessError as e:
-        if "Another calibre program" in e.stderr:
-            print("\n[Error]: Calibre database is locked because the Calibre desktop app is open.")
-            print("Please close Calibre and run the script again, or update the book manually in Calibre.")
-        else:
-            print(f"Failed Calibre sync: {e.stderr if e.stderr else e}")
-    except Exception as e:
-        print(f"Failed Calibre sync: {e}")
+    """Pushes the digest EPUB to Calibre, reusing the Calibre id cached in the articles DB."""
+    return sync_epubs(DB_PATH, [(CALIBRE_BOOK_TITLE, EPUB_PATH)])
 
 def main():
     init_db()
@@ -0,0 +1,93 @@
+import argparse
+import glob
+import os
+import re
+import time
+
+from bs4 import BeautifulSoup
+
+import crawler
+from bench_crawler import render_chapter
+from cleaner import html_to_text
+
+FIXTURE_DIR = os.path.join(crawler.BASE_DIR, "fixtures", "chapters")
+
+
+def legacy_clean_html_content(raw_html):
+    """The BeautifulSoup implementation clean_html_content used before cleaner.py."""
+    soup = BeautifulSoup(raw_html, "html.parser")
+    garbage_selectors = [
+        "script", "style", "iframe", "ins", "button",
+        ".chapter-nav", ".ads", ".sharedaddy", ".wpcnt",
+        "nav", "header", "footer"
+    ]
+    for selector in garbage_selectors:
+        for tag in soup.select(selector):
+            tag.decompose()
+    return str(soup)
+
+
+def generate_fixtures(count, page_kb, fixture_dir):
+    """Saves `count` synthetic chapter pages as served, before any cleaning, to benchmark against.
+
+    Stored chapters are already cleaned, so they leave the cleaner nothing to
+    remove; these pages carry the scripts, ads and navigation of bench_crawler's sites.
+    """
+    os.makedirs(fixture_dir, exist_ok=True)
+    styles = ("rel-next", "link-text", "button")
+    for number in range(1, count + 1):
+        options = {"nav": styles[number % len(styles)], "pages": count + 1, "page_kb": page_kb}
+        with open(os.path.join(fixture_dir, f"chapter_{number}.html"), "w", encoding="utf-8") as f:
+            f.write(render_chapter("bench", number, options))
+    print(f"Saved {count} fixtures to {fixture_dir}")
+
+
+def time_per_page(clean, pages, rounds):
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for html in pages:
+            clean(html)
+        best = min(best, time.perf_counter() - start)
+    return best / len(pages)
+
+
+def normalized_text(html):
+    return re.sub(r"\s+", " ", html_to_text(html)).strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare clean_html_content against the old BeautifulSoup cleaner.")
+    parser.add_argument("--fixtures", default=FIXTURE_DIR, help=f"Directory of raw chapter pages (default {FIXTURE_DIR})")
+    parser.add_argument("--generate", type=int, metavar="N", help="First save N synthetic raw chapter pages as fixtures")
+    parser.add_argument("--page-kb", type=int, default=20, help="Text per generated page in KB (default 20)")
+    parser.add_argument("--rounds", type=int, default=5, help="Timed rounds, best one is reported (default 5)")
+    args = parser.parse_args()
+
+    if args.generate:
+        generate_fixtures(args.generate, args.page_kb, args.fixtures)
+
+    pages = []
+    for path in sorted(glob.glob(os.path.join(args.fixtures, "*.html"))):
+        with open(path, encoding="utf-8") as f:
+            pages.append(f.read())
+    if not pages:
+        print(f"No fixtures in {args.fixtures}; run with --generate N first, or save raw pages there.")
+        return
+
+    legacy = time_per_page(legacy_clean_html_content, pages, args.rounds)
+    current = time_per_page(crawler.clean_html_content, pages, args.rounds)
+    mismatches = sum(
+        normalized_text(legacy_clean_html_content(html)) != normalized_text(crawler.clean_html_content(html))
+        for html in pages
+    )
+
+    size = sum(len(html) for html in pages) / len(pages) / 1024
+    print(f"{len(pages)} fixtures, {size:.0f} KB average")
+    print(f"  legacy (BeautifulSoup): {legacy * 1000:8.2f} ms/page")
+    print(f"  clean_html_content:     {current * 1000:8.2f} ms/page  ({legacy / current:.1f}x faster)")
+    print(f"  pages whose text differs: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
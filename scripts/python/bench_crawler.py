@@ -0,0 +1,321 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Synthetic sites: how the 'Next' control looks and what stands between the crawler and the text.
+# Everything but rel-next and link-text needs the browser.
+SCENARIOS = {
+    "rel-next": {"nav": "rel-next"},
+    "link-text": {"nav": "link-text"},
+    "button-only": {"nav": "button"},
+    "ao3-gate": {"nav": "rel-next", "gate": True},
+    "spa": {"nav": "spa"},
+}
+
+WORDS = (
+    "the sword qi cultivator sect elder heaven dao jade palace ancient beast spirit stone young master "
+    "mountain river realm breakthrough disciple formation array demon immortal blood moon"
+).split()
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html><head><title>{title}</title>{head}
+<script>window.dataLayer = window.dataLayer || []; function gtag(){{dataLayer.push(arguments);}}</script>
+<style>body {{ font-family: serif; }} .ads {{ display: block; }}</style>
+</head><body>
+<header><nav class="site-nav"><a href="/">Home</a> <a href="/novels">Novels</a></nav></header>
+{gate}
+<div class="ads"><ins class="adsbygoogle"></ins><iframe src="about:blank"></iframe></div>
+<h1>{title}</h1>
+<div id="content">{content}</div>
+<div class="chapter-nav">{nav}</div>
+<div class="sharedaddy">Share this chapter</div>
+<footer>Synthetic benchmark site</footer>
+</body></html>"""
+
+SPA_SCRIPT = """<script>
+let current = {number};
+async function load(n) {{
+    const response = await fetch("{base}/api/" + n);
+    document.getElementById("content").innerHTML = await response.text();
+    document.title = "Chapter " + n;
+    document.getElementById("next").style.display = n < {last} ? "" : "none";
+}}
+function next() {{
+    current += 1;
+    history.pushState({{}}, "", "{base}/ch/" + current + ".html");
+    load(current);
+}}
+load(current);
+</script>"""
+
+TOS_PROMPT = """<div id="tos_prompt"><p>Terms of Service</p>
+<input type="checkbox" id="tos_agree"> <input type="checkbox" id="data_processing_agree">
+<button id="accept_tos" onclick="document.cookie='accepted_tos=1; path=/'; document.getElementById('tos_prompt').remove()">I agree</button>
+</div>"""
+
+AGE_GATE = """<p>This work could have adult content.</p>
+<form method="get" action="{path}"><input type="hidden" name="view_adult" value="true">
+<input type="submit" name="commit" value="Proceed"></form>"""
+
+
+def chapter_text(number, page_kb):
+    """Deterministic filler paragraphs of roughly `page_kb` KB for chapter `number`."""
+    rng = random.Random(number)
+    paragraphs, size = [], 0
+    while size < page_kb * 1024:
+        paragraph = "<p>" + " ".join(rng.choice(WORDS) for _ in range(rng.randint(40, 90))).capitalize() + ".</p>"
+        paragraphs.append(paragraph)
+        size += len(paragraph)
+    return "\n".join(paragraphs)
+
+
+def render_chapter(site, number, options, cookies=(), query=None):
+    """Full HTML of one chapter page of `site` as the server sends it."""
+    base = f"/s/{site}"
+    last = options["pages"]
+    title = f"Chapter {number}"
+    content = chapter_text(number, options["page_kb"])
+    head, gate, nav = "", "", ""
+    has_next = number < last
+    next_href = f"{number + 1}.html"
+
+    if options["nav"] == "rel-next" and has_next:
+        head = f'<link rel="next" href="{next_href}">'
+        nav = f'<a href="{number - 1}.html">Previous</a> <a rel="next" href="{next_href}">Next</a>'
+    elif options["nav"] == "link-text" and has_next:
+        nav = f'<a href="{number - 1}.html">« Prev</a> <a href="{next_href}">Next Chapter »</a>'
+    elif options["nav"] == "button" and has_next:
+        nav = f"<button onclick=\"location.href='{next_href}'\">Next Chapter</button>"
+    elif options["nav"] == "spa":
+        # The text arrives from the API after load; the button swaps chapters in place
+        content = ""
+        nav = '<button id="next" onclick="next()">Next Chapter</button>'
+        head = SPA_SCRIPT.format(number=number, base=base, last=last)
+
+    if options.get("gate"):
+        adult_ok = "view_adult" in cookies or (query or {}).get("view_adult") == ["true"]
+        if not adult_ok:
+            content, nav = "", ""
+            gate = AGE_GATE.format(path=f"{base}/ch/{number}.html")
+        elif "accepted_tos" not in cookies:
+            gate = TOS_PROMPT
+    return PAGE_TEMPLATE.format(title=title, head=head, gate=gate, content=content, nav=nav)
+
+
+class SyntheticSites(ThreadingHTTPServer):
+    """Local HTTP server for the benchmark sites, each under /s/<scenario>/.
+
+    Chapter pages live at /s/<scenario>/ch/<n>.html and SPA text at
+    /s/<scenario>/api/<n>. Every response is delayed by the configured latency.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, sites, latency_ms):
+        super().__init__(("127.0.0.1", 0), SiteHandler)
+        self.sites = sites
+        self.latency = latency_ms / 1000
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+
+class SiteHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        parsed = urlparse(self.path)
+        parts = parsed.path.strip("/").split("/")
+        if len(parts) != 4 or parts[0] != "s" or parts[1] not in self.server.sites:
+            return self.send_error(404)
+        site, kind, name = parts[1], parts[2], parts[3]
+        options = self.server.sites[site]
+        try:
+            number = int(name.removesuffix(".html"))
+        except ValueError:
+            return self.send_error(404)
+        if not 1 <= number <= options["pages"]:
+            return self.send_error(404)
+
+        cookies = {c.split("=")[0].strip() for c in self.headers.get("Cookie", "").split(";") if "=" in c}
+        query = parse_qs(parsed.query)
+        if kind == "api":
+            body = chapter_text(number, options["page_kb"])
+        elif kind == "ch":
+            body = render_chapter(site, number, options, cookies, query)
+        else:
+            return self.send_error(404)
+
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        if query.get("view_adult") == ["true"]:
+            self.send_header("Set-Cookie", "view_adult=true; Path=/")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else None
+
+
+def run_scenario(name, start_url, options, chapters, pacing):
+    """Crawls, cleans and compiles one synthetic site in a throwaway home directory.
+
+    Runs in its own process, so peak RSS belongs to this scenario alone and
+    nothing touches the real ~/github/knowledge.
+    """
+    home = tempfile.mkdtemp(prefix=f"bench-{name}-")
+    # Playwright finds its browsers under ~ too; keep pointing it at the real ones
+    os.environ.setdefault("PLAYWRIGHT_BROWSERS_PATH", os.path.expanduser("~/.cache/ms-playwright"))
+    os.environ["HOME"] = home
+    # Imported only now so every path derived from ~ points into the temporary home
+    import crawler
+    from ratelimit import HostRateLimiter
+    from storage import connect
+
+    if not pacing:
+        crawler.PACING = HostRateLimiter(os.path.join(home, "host_limits.json"), initial_rate=1000, max_rate=1000)
+    # Every scenario pays the same cold start instead of reusing a browser server
+    crawler.USE_BROWSER_SERVER = False
+    crawler.init_db()
+    with connect(crawler.DB_PATH) as conn:
+        book_id = conn.execute(
+            "INSERT INTO books (title, start_url, selector, confirmed) VALUES (?, ?, '#content', 1)",
+            (f"Bench {name}", start_url)
+        ).lastrowid
+
+    started = time.perf_counter()
+    count = crawler.scrape_incremental(book_id, start_url, "#content", None, chapters, preview=False)
+    crawl_seconds = time.perf_counter() - started
+
+    per_chapter = [
+        row[0] for row in connect(crawler.DB_PATH).execute(
+            "SELECT SUM(seconds) FROM crawl_metrics WHERE book_id = ? GROUP BY url", (book_id,)
+        )
+    ]
+
+    raw_pages = [render_chapter(name, n, dict(options, gate=False)) for n in range(1, min(chapters, 50) + 1)]
+    clean_times = []
+    for html in raw_pages:
+        t = time.perf_counter()
+        crawler.clean_html_content(html)
+        clean_times.append(time.perf_counter() - t)
+
+    started = time.perf_counter()
+    crawler.compile_epub(book_id, f"Bench {name}")
+    compile_seconds = time.perf_counter() - started
+
+    crawler.close_all()
+    shutil.rmtree(home, ignore_errors=True)
+    ms = lambda seconds: round(seconds * 1000, 2) if seconds is not None else None
+    return {
+        "status": "ok" if count == chapters else "incomplete",
+        "chapters": count,
+        "crawl_seconds": round(crawl_seconds, 3),
+        "chapters_per_sec": round(count / crawl_seconds, 2) if crawl_seconds else None,
+        "chapter_p50_ms": ms(percentile(per_chapter, 0.5)),
+        "chapter_p95_ms": ms(percentile(per_chapter, 0.95)),
+        "clean_p50_ms": ms(percentile(clean_times, 0.5)),
+        "clean_p95_ms": ms(percentile(clean_times, 0.95)),
+        "compile_seconds": round(compile_seconds, 3),
+        # ru_maxrss is in KB on Linux; children covers the browser once it has exited
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "peak_children_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+    }
+
+
+def compare(results, previous_path):
+    """Prints how each scenario moved against an earlier results file."""
+    with open(previous_path, encoding="utf-8") as f:
+        previous = json.load(f)["scenarios"]
+    print(f"\nCompared with {previous_path}:")
+    for name, result in results.items():
+        before = previous.get(name)
+        if not before or not before.get("chapters_per_sec") or not result.get("chapters_per_sec"):
+            continue
+        change = (result["chapters_per_sec"] / before["chapters_per_sec"] - 1) * 100
+        print(
+            f"  {name:<12} {before['chapters_per_sec']:>7} -> {result['chapters_per_sec']:>7} ch/s ({change:+.0f}%), "
+            f"p95 {before['chapter_p95_ms']} -> {result['chapter_p95_ms']} ms"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the crawler against local synthetic novel sites.")
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS), default=list(SCENARIOS),
+                        help="Sites to crawl (default: all)")
+    parser.add_argument("--chapters", type=int, default=50, help="Chapters crawled per site (default 50)")
+    parser.add_argument("--latency", type=float, default=50, metavar="MS", help="Server delay per request (default 50)")
+    parser.add_argument("--page-kb", type=float, default=20, help="Chapter text size in KB (default 20)")
+    parser.add_argument("--pacing", action="store_true", help="Keep the real per-host rate limits")
+    parser.add_argument("--output", help="Results file (default ~/github/knowledge/benchmarks/crawler-<time>.json)")
+    parser.add_argument("--compare", metavar="PATH", help="Earlier results file to compare against")
+    args = parser.parse_args()
+
+    # One page more than is crawled, so the last crawled chapter still has a 'Next' link
+    sites = {
+        name: dict(SCENARIOS[name], pages=args.chapters + 1, page_kb=args.page_kb) for name in args.scenarios
+    }
+    server = SyntheticSites(sites, args.latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    results = {}
+    spawn = multiprocessing.get_context("spawn")
+    for name in args.scenarios:
+        print(f"=== {name} ===")
+        start_url = f"{server.base_url}/s/{name}/ch/1.html"
+        with spawn.Pool(1) as pool:
+            try:
+                results[name] = pool.apply(run_scenario, (name, start_url, sites[name], args.chapters, args.pacing))
+            except Exception as e:
+                print(f"[Error]: Scenario {name} failed: {e}")
+                results[name] = {"status": "failed", "error": str(e)}
+    server.shutdown()
+
+    print(f"\n{'scenario':<12} {'status':<10} {'ch/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'clean p95':>10} {'compile s':>10} {'RSS MB':>7}")
+    for name, r in results.items():
+        if "chapters_per_sec" not in r:
+            print(f"{name:<12} {r['status']:<10}")
+            continue
+        print(
+            f"{name:<12} {r['status']:<10} {r['chapters_per_sec'] or 0:>7} {r['chapter_p50_ms'] or 0:>8} "
+            f"{r['chapter_p95_ms'] or 0:>8} {r['clean_p95_ms'] or 0:>10} {r['compile_seconds']:>10} {r['peak_rss_mb']:>7}"
+        )
+
+    output = args.output or os.path.expanduser(
+        f"~/github/knowledge/benchmarks/crawler-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "settings": {"chapters": args.chapters, "latency_ms": args.latency, "page_kb": args.page_kb, "pacing": args.pacing},
+            "scenarios": results,
+        }, f, indent=2)
+    print(f"\nResults saved to {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
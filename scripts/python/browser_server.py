@@ -0,0 +1,261 @@
+import argparse
+import fcntl
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from urllib.parse import urlparse
+
+# Everything the supervisor keeps between runs: pid, endpoint, launch config and log
+SERVER_DIR = os.path.expanduser("~/github/knowledge/browser_server")
+PID_PATH = os.path.join(SERVER_DIR, "server.pid")
+ENDPOINT_PATH = os.path.join(SERVER_DIR, "endpoint")
+CONFIG_PATH = os.path.join(SERVER_DIR, "config.json")
+LOG_PATH = os.path.join(SERVER_DIR, "server.log")
+# Each connected browser holds a shared lock on this; restarts need it exclusively
+LEASE_PATH = os.path.join(SERVER_DIR, "lease")
+# Serializes checks and restarts, so two crawlers never start two servers
+START_LOCK_PATH = os.path.join(SERVER_DIR, "start.lock")
+
+# Options passed to Playwright's launchServer; without a host it listens on all interfaces
+LAUNCH_CONFIG = {"headless": True, "host": "127.0.0.1"}
+# Firefox and its content processes together; past this the server is restarted when idle
+MAX_RSS_MB = 1500
+START_TIMEOUT = 30
+
+# Open lease files of the connected browsers, by id(browser)
+_leases = {}
+
+
+def _read(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _write(path, value):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(value)
+    os.replace(tmp_path, path)
+
+
+def _alive(pid):
+    try:
+        # Reap the server if this process started it (the supervisor), or it lingers as a zombie
+        if os.waitpid(pid, os.WNOHANG)[0] == pid:
+            return False
+    except ChildProcessError:
+        pass
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+def server_pid():
+    """The pid from the pidfile if that process is still alive, else None."""
+    pid = _read(PID_PATH)
+    if not pid or not pid.isdigit() or not _alive(int(pid)):
+        return None
+    return int(pid)
+
+
+def tree_rss_mb(pid):
+    """Resident memory of `pid` and all its descendants in MB (Linux /proc; 0 elsewhere)."""
+    children, rss = {}, {}
+    for entry in os.listdir("/proc") if os.path.isdir("/proc") else []:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", encoding="utf-8") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        children.setdefault(int(fields[1]), []).append(int(entry))
+        rss[int(entry)] = int(fields[21]) * os.sysconf("SC_PAGE_SIZE")
+    total, todo = 0, [pid]
+    while todo:
+        current = todo.pop()
+        total += rss.get(current, 0)
+        todo.extend(children.get(current, []))
+    return total / 1024 / 1024
+
+
+def healthy():
+    """Returns the endpoint if the server process is alive and accepting connections, else None."""
+    endpoint = _read(ENDPOINT_PATH)
+    if not endpoint or not server_pid():
+        return None
+    address = urlparse(endpoint)
+    try:
+        with socket.create_connection((address.hostname, address.port), timeout=2):
+            return endpoint
+    except OSError:
+        return None
+
+
+def start():
+    """Launches `playwright launch-server` in its own session and returns its ws endpoint."""
+    os.makedirs(SERVER_DIR, exist_ok=True)
+    _write(CONFIG_PATH, json.dumps(LAUNCH_CONFIG))
+    # The server prints its endpoint on the first line; a log file never fills up like a pipe
+    with open(LOG_PATH, "w", encoding="utf-8") as log:
+        process = subprocess.Popen(
+            [sys.executable, "-m", "playwright", "launch-server", "--browser", "firefox", "--config", CONFIG_PATH],
+            stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL, start_new_session=True
+        )
+    deadline = time.monotonic() + START_TIMEOUT
+    while time.monotonic() < deadline:
+        output = _read(LOG_PATH) or ""
+        endpoint = next((line for line in output.splitlines() if line.startswith("ws://")), None)
+        if endpoint:
+            _write(PID_PATH, str(process.pid))
+            _write(ENDPOINT_PATH, endpoint)
+            print(f"  [Debug] Browser server {process.pid} listening on {endpoint}")
+            return endpoint
+        if process.poll() is not None:
+            break
+        time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"Browser server did not start, see {LOG_PATH}")
+
+
+def stop():
+    """Terminates the server's process group and removes the pid and endpoint files."""
+    pid = server_pid()
+    if pid:
+        try:
+            os.killpg(pid, signal.SIGTERM)
+            for _ in range(50):
+                if not _alive(pid):
+                    break
+                time.sleep(0.1)
+            else:
+                os.killpg(pid, signal.SIGKILL)
+        except OSError:
+            pass
+    for path in (PID_PATH, ENDPOINT_PATH):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _idle():
+    """True if no crawler holds a lease, i.e. restarting will not cut anyone off."""
+    os.makedirs(SERVER_DIR, exist_ok=True)
+    with open(LEASE_PATH, "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        fcntl.flock(f, fcntl.LOCK_UN)
+    return True
+
+
+def ensure_running(max_rss_mb=MAX_RSS_MB):
+    """Returns the endpoint of a healthy server, starting or restarting one as needed.
+
+    A server past `max_rss_mb` is only restarted while no crawler is connected.
+    """
+    os.makedirs(SERVER_DIR, exist_ok=True)
+    with open(START_LOCK_PATH, "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        endpoint = healthy()
+        if endpoint:
+            rss = tree_rss_mb(server_pid())
+            if rss <= max_rss_mb or not _idle():
+                return endpoint
+            print(f"  [Debug] Browser server uses {rss:.0f} MB, restarting it.")
+        elif server_pid():
+            print("  [Debug] Browser server is not answering, restarting it.")
+        stop()
+        return start()
+
+
+def take_lease():
+    """Opens a shared lock on the lease file; restarts wait until the returned file is closed."""
+    os.makedirs(SERVER_DIR, exist_ok=True)
+    lease = open(LEASE_PATH, "a")
+    fcntl.flock(lease, fcntl.LOCK_SH)
+    return lease
+
+
+def connect_or_launch(playwright):
+    """Connects to the shared Firefox server (starting it if none runs), else launches a private Firefox.
+
+    Connected browsers survive close(): it only drops this client's connection
+    and contexts, so the next run skips the browser's cold start. Close them
+    with disconnect(), which also releases the lease taken here.
+    """
+    lease = None
+    try:
+        # Checked before taking the lease, which would otherwise block our own restart
+        endpoint = ensure_running()
+        lease = take_lease()
+        browser = playwright.firefox.connect(endpoint, timeout=15000)
+        _leases[id(browser)] = lease
+        return browser
+    except Exception as e:
+        if lease:
+            lease.close()
+        print(f"  [Debug] Browser server unavailable ({e}), launching Firefox.")
+    return playwright.firefox.launch(headless=True)
+
+
+def disconnect(browser):
+    """Closes `browser` and releases its lease, so an idle server can be restarted again."""
+    try:
+        browser.close()
+    finally:
+        lease = _leases.pop(id(browser), None)
+        if lease:
+            lease.close()
+
+
+def supervise(interval=60, max_rss_mb=MAX_RSS_MB):
+    """Keeps a server up: checks it every `interval` seconds and restarts it when dead or too big."""
+    print(f"Supervising the browser server (every {interval:g}s, limit {max_rss_mb} MB)...")
+    try:
+        while True:
+            try:
+                ensure_running(max_rss_mb)
+            except Exception as e:
+                print(f"[Error]: {e}")
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Long-lived Firefox server shared by crawler runs.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("start", help="Start a server unless a healthy one runs")
+    commands.add_parser("stop", help="Stop the server")
+    commands.add_parser("status", help="Show the endpoint and memory use")
+    keep = commands.add_parser("supervise", help="Run in the foreground, restarting the server as needed")
+    keep.add_argument("--interval", type=float, default=60, help="Seconds between health checks (default 60)")
+    keep.add_argument("--max-rss-mb", type=int, default=MAX_RSS_MB, help=f"Restart above this (default {MAX_RSS_MB})")
+    args = parser.parse_args()
+
+    if args.command == "start":
+        print(ensure_running())
+    elif args.command == "stop":
+        stop()
+    elif args.command == "status":
+        endpoint = healthy()
+        if endpoint:
+            print(f"{endpoint} (pid {server_pid()}, {tree_rss_mb(server_pid()):.0f} MB, {'idle' if _idle() else 'in use'})")
+        else:
+            print("Not running.")
+    elif args.command == "supervise":
+        supervise(args.interval, args.max_rss_mb)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+import argparse
+import json
+import os
+import re
+import subprocess
+
+from storage import connect
+
+LOCKED_MESSAGE = "Another calibre program"
+
+# Runs inside calibre-debug: pushes every job through one open library instead
+# of one calibredb process (and Python/calibre start-up) per book. Prints a
+# single JSON line: {"locked": bool, "ids": {title: id}, "errors": {title: message}}.
+SESSION_SCRIPT = """
+import json
+from calibre.utils.lock import singleinstance
+from calibre.utils.config import prefs
+from calibre.library import db
+from calibre.ebooks.metadata.meta import get_metadata
+
+def run(jobs):
+    # The desktop app and calibredb hold the same lock; never write behind their back
+    if not singleinstance("db"):
+        print(json.dumps({"locked": True, "ids": {}, "errors": {}}))
+        return
+    cache = db(prefs["library_path"]).new_api
+    ids, errors = {}, {}
+    for job in jobs:
+        try:
+            book_id = job["calibre_id"]
+            if book_id is not None and not cache.has_id(book_id):
+                book_id = None
+            if book_id is None:
+                found = cache.search('title:"=%s"' % job["title"].replace('"', '\\\\"'))
+                book_id = min(found) if found else None
+            if book_id is None:
+                with open(job["path"], "rb") as f:
+                    mi = get_metadata(f, "epub")
+                book_id = cache.add_books([(mi, {"EPUB": job["path"]})])[0][0]
+            else:
+                cache.add_format(book_id, "EPUB", job["path"], replace=True)
+            ids[job["title"]] = book_id
+        except Exception as e:
+            errors[job["title"]] = str(e)
+    print(json.dumps({"locked": False, "ids": ids, "errors": errors}))
+"""
+
+
+class CalibreLocked(Exception):
+    """The Calibre desktop app (or calibre-server) has the library open."""
+
+
+def _ensure_tables(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS calibre_books (
+            title TEXT PRIMARY KEY,
+            calibre_id INTEGER
+        )
+    """)
+    # EPUBs that could not be pushed yet; `id_table` says where their Calibre id lives
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS calibre_queue (
+            title TEXT PRIMARY KEY,
+            epub_path TEXT,
+            id_table TEXT,
+            queued_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def _push_with_session(jobs):
+    """Pushes all jobs in one calibre-debug process; raises FileNotFoundError without calibre-debug."""
+    code = SESSION_SCRIPT + f"\nrun(json.loads({json.dumps(jobs)!r}))\n"
+    result = subprocess.run(["calibre-debug", "-c", code], capture_output=True, text=True)
+    if LOCKED_MESSAGE in result.stderr:
+        raise CalibreLocked(result.stderr.strip())
+    lines = [line for line in result.stdout.splitlines() if line.startswith("{")]
+    if result.returncode != 0 or not lines:
+        raise RuntimeError(f"calibre-debug failed: {result.stderr.strip() or result.stdout.strip()}")
+    outcome = json.loads(lines[-1])
+    if outcome["locked"]:
+        raise CalibreLocked("Calibre library is in use")
+    return outcome["ids"], outcome["errors"]
+
+
+def _calibredb(*args):
+    result = subprocess.run(["calibredb", *args], capture_output=True, text=True)
+    if LOCKED_MESSAGE in result.stderr:
+        raise CalibreLocked(result.stderr.strip())
+    return result
+
+
+def _push_with_calibredb(jobs):
+    """Fallback without calibre-debug: one calibredb call per book, searching only for unknown ids."""
+    ids, errors = {}, {}
+    for job in jobs:
+        book_id = job["calibre_id"]
+        if book_id is None:
+            # Exit code 1 means "no results"
+            found = _calibredb("search", f'title:"={job["title"]}"').stdout.strip()
+            book_id = int(found.split(",")[0]) if found else None
+        if book_id is not None:
+            result = _calibredb("add_format", str(book_id), job["path"])
+        else:
+            result = _calibredb("add", job["path"])
+            added = re.search(r"Added book ids: (\d+)", result.stdout)
+            book_id = int(added.group(1)) if added else None
+        if result.returncode != 0 or book_id is None:
+            errors[job["title"]] = result.stderr.strip() or result.stdout.strip()
+        else:
+            ids[job["title"]] = book_id
+    return ids, errors
+
+
+def _load_id(conn, table, title):
+    row = conn.execute(f"SELECT calibre_id FROM {table} WHERE title = ?", (title,)).fetchone()
+    return row[0] if row else None
+
+
+def _save_id(conn, table, title, calibre_id):
+    if conn.execute(f"UPDATE {table} SET calibre_id = ? WHERE title = ?", (calibre_id, title)).rowcount == 0:
+        conn.execute(f"INSERT INTO {table} (title, calibre_id) VALUES (?, ?)", (title, calibre_id))
+
+
+def sync_epubs(db_path, items, id_table="calibre_books"):
+    """Pushes (title, epub_path) pairs, plus anything queued earlier, to Calibre in one session.
+
+    Calibre book ids are cached in `id_table` (a table with title and
+    calibre_id columns) of `db_path`, so known books skip the search. If the
+    library is locked by the desktop app, the EPUBs are queued in calibre_queue
+    and retried by the next sync. Returns {title: calibre_id} of what was synced.
+    """
+    conn = connect(db_path)
+    with conn:
+        _ensure_tables(conn)
+    jobs = {
+        title: (path, table) for title, path, table in
+        conn.execute("SELECT title, epub_path, id_table FROM calibre_queue")
+    }
+    jobs.update({title: (path, id_table) for title, path in items})
+    gone = [title for title, (path, _) in jobs.items() if not os.path.exists(path)]
+    with conn:
+        conn.executemany("DELETE FROM calibre_queue WHERE title = ?", [(title,) for title in gone])
+    for title in gone:
+        del jobs[title]
+    if not jobs:
+        return {}
+    batch = [
+        {"title": title, "path": path, "calibre_id": _load_id(conn, table, title)}
+        for title, (path, table) in jobs.items()
+    ]
+
+    print(f"Syncing {len(batch)} EPUB(s) with Calibre library...")
+    try:
+        try:
+            ids, errors = _push_with_session(batch)
+        except (FileNotFoundError, RuntimeError) as e:
+            if isinstance(e, RuntimeError):
+                print(f"  [Debug] {e}; falling back to calibredb.")
+            ids, errors = _push_with_calibredb(batch)
+    except FileNotFoundError:
+        print("\n[Warning]: 'calibredb' command utility was not found in system PATH.")
+        return {}
+    except CalibreLocked:
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO calibre_queue (title, epub_path, id_table) VALUES (?, ?, ?)",
+                [(title, path, table) for title, (path, table) in jobs.items()]
+            )
+        print("\n[Warning]: Calibre database is locked because the Calibre desktop app is open.")
+        print(f"Queued {len(jobs)} EPUB(s); they are pushed by the next sync or 'python3 calibre_sync.py retry'.")
+        return {}
+    except Exception as e:
+        print(f"Failed Calibre sync: {e}")
+        return {}
+
+    with conn:
+        for title, calibre_id in ids.items():
+            _save_id(conn, jobs[title][1], title, calibre_id)
+            conn.execute("DELETE FROM calibre_queue WHERE title = ?", (title,))
+    for title, calibre_id in sorted(ids.items()):
+        print(f"  {title}: Calibre book {calibre_id}")
+    for title, message in errors.items():
+        print(f"  [Error] {title}: {message}")
+    return ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Push EPUBs queued while Calibre was locked.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    retry = commands.add_parser("retry", help="Retry the queued syncs of these databases")
+    retry.add_argument("db_paths", nargs="+", help="Database files, e.g. ~/github/knowledge/novels_digest.db")
+    args = parser.parse_args()
+
+    if args.command == "retry":
+        for db_path in args.db_paths:
+            sync_epubs(os.path.expanduser(db_path), [])
+
+
+if __name__ == "__main__":
+    main()
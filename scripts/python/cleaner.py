@@ -0,0 +1,72 @@
+from functools import lru_cache
+
+import lxml.html
+from lxml import etree
+from lxml.cssselect import CSSSelector
+
+
+@lru_cache(maxsize=None)
+def css(selector):
+    """Compiles a CSS selector to XPath once and reuses it afterwards."""
+    return CSSSelector(selector)
+
+
+class HtmlCleaner:
+    """Removes every node matching a fixed list of CSS selectors in one pass.
+
+    The selectors are compiled once into a single XPath expression, so cleaning a
+    page is one lxml parse, one query and one compact serialization.
+    """
+
+    def __init__(self, selectors):
+        self.compiled = css(", ".join(selectors))
+
+    def clean(self, html):
+        """Returns the HTML fragment `html` without the matching nodes."""
+        if not html or not html.strip():
+            return ""
+        root = lxml.html.fragment_fromstring(html, create_parent="div")
+        self.clean_tree(root)
+        return inner_html(root)
+
+    def clean_tree(self, root):
+        """Removes the matching nodes from an already parsed tree, in place."""
+        for el in self.compiled(root):
+            # drop_tree keeps the text that follows the removed element
+            el.drop_tree()
+        return root
+
+
+def parse_document(html):
+    return lxml.html.document_fromstring(html)
+
+
+def select_one(root, *selectors):
+    """Returns the first element matching the first selector that matches anything, or None."""
+    for selector in selectors:
+        matches = css(selector)(root)
+        if matches:
+            return matches[0]
+    return None
+
+
+def inner_html(el):
+    """Serializes the children of an element without the element itself."""
+    parts = [escape_text(el.text)] if el.text else []
+    parts.extend(etree.tostring(child, encoding="unicode", method="html") for child in el)
+    return "".join(parts)
+
+
+def outer_html(el):
+    return etree.tostring(el, encoding="unicode", method="html", with_tail=False)
+
+
+def escape_text(text):
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def html_to_text(html):
+    """Extracts the readable text of an HTML fragment or document."""
+    if not html or not html.strip():
+        return ""
+    return lxml.html.fragment_fromstring(html, create_parent="div").text_content()
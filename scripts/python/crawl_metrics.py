@@ -0,0 +1,123 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from storage import connect
+
+# Stages in the order a chapter goes through them; the report lists them this way
+STAGES = (
+    "pacing", "http_fetch", "static_parse", "navigation", "gate", "readiness",
+    "extract", "next_link", "clean", "store", "index",
+)
+
+
+def create_metrics_table(conn):
+    """One row per stage of each fetched chapter."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS crawl_metrics (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            book_id INTEGER,
+            host TEXT,
+            url TEXT,
+            backend TEXT,
+            stage TEXT,
+            seconds REAL,
+            bytes INTEGER DEFAULT 0,
+            retries INTEGER DEFAULT 0,
+            recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_crawl_metrics_time ON crawl_metrics(recorded_at)")
+
+
+class ChapterMetrics:
+    """Collects the timing spans, bytes and retries of one chapter fetch.
+
+    Spans of the same stage add up (e.g. pacing before each retry). Bytes and
+    retries belong to the stage that caused them, usually http_fetch or
+    navigation. write() queues everything as a single multi-row INSERT.
+    """
+
+    def __init__(self, book_id, url, host):
+        self.book_id = book_id
+        self.url = url
+        self.host = host
+        self.backend = "http"
+        self.spans = {}  # stage -> seconds
+        self.bytes = defaultdict(int)
+        self.retries = defaultdict(int)
+
+    @contextmanager
+    def span(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def add(self, stage, seconds, bytes_transferred=0, retries=0):
+        self.spans[stage] = self.spans.get(stage, 0.0) + seconds
+        self.bytes[stage] += bytes_transferred
+        self.retries[stage] += retries
+
+    def write(self, writer):
+        """Queues the recorded spans on a storage.BatchWriter."""
+        if not self.spans:
+            return
+        rows = [
+            (self.book_id, self.host, self.url, self.backend, stage, seconds, self.bytes[stage], self.retries[stage])
+            for stage, seconds in self.spans.items()
+        ]
+        placeholders = ", ".join(["(?, ?, ?, ?, ?, ?, ?, ?)"] * len(rows))
+        sql = f"INSERT INTO crawl_metrics (book_id, host, url, backend, stage, seconds, bytes, retries) VALUES {placeholders}"
+        writer.add(sql, [value for row in rows for value in row])
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a sorted list."""
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def print_report(db_path, since_days=None, book_id=None):
+    """Prints stage percentiles per book and per domain from crawl_metrics."""
+    conn = connect(db_path)
+    where, params = ["1 = 1"], []
+    if since_days:
+        where.append("m.recorded_at >= datetime('now', ?)")
+        params.append(f"-{since_days} days")
+    if book_id:
+        where.append("m.book_id = ?")
+        params.append(book_id)
+    rows = conn.execute(
+        "SELECT COALESCE(b.title, 'book ' || m.book_id), m.host, m.url, m.stage, m.seconds, m.bytes, m.retries "
+        "FROM crawl_metrics m LEFT JOIN books b ON b.id = m.book_id "
+        f"WHERE {' AND '.join(where)}", params
+    ).fetchall()
+    if not rows:
+        print("No crawl metrics recorded yet.")
+        return
+
+    for label, key in (("book", 0), ("domain", 1)):
+        seconds = defaultdict(lambda: defaultdict(list))  # group -> stage -> [seconds]
+        chapters = defaultdict(set)
+        totals = defaultdict(lambda: [0, 0])  # group -> [bytes, retries]
+        for row in rows:
+            group = row[key]
+            seconds[group][row[3]].append(row[4])
+            chapters[group].add(row[2])
+            totals[group][0] += row[5]
+            totals[group][1] += row[6]
+
+        print(f"\n=== Per {label} ===")
+        for group in sorted(seconds):
+            n = len(chapters[group])
+            data, retries = totals[group]
+            print(f"\n{group}: {n} chapter(s), {data / max(n, 1) / 1024:.1f} KB/chapter, {retries} retries")
+            print(f"  {'stage':<14} {'count':>6} {'p50':>8} {'p90':>8} {'p99':>8} {'total':>9}")
+            known = [stage for stage in STAGES if stage in seconds[group]]
+            for stage in known + sorted(set(seconds[group]) - set(known)):
+                values = sorted(seconds[group][stage])
+                print(
+                    f"  {stage:<14} {len(values):>6} {percentile(values, 0.5):>7.3f}s "
+                    f"{percentile(values, 0.9):>7.3f}s {percentile(values, 0.99):>7.3f}s {sum(values):>8.1f}s"
+                )
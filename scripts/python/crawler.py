@@ -1,20 +1,90 @@
 import os
-import sqlite3
+import json
+import argparse
+import threading
 import time
-import subprocess
-from urllib.parse import urlparse
+import hashlib
+from collections import Counter, deque
+from itertools import islice
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from urllib.parse import urlparse, urljoin
+import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
-from ebooklib import epub
 from playwright.sync_api import sync_playwright
+from storage import connect, close_all, add_column, BatchWriter, compress_html, decompress_html
+from ratelimit import HostRateLimiter, THROTTLE_STATUSES, polite_get
+from readiness import Readiness
+from crawl_metrics import ChapterMetrics, create_metrics_table, print_report
+from epub_writer import EpubWriter, NotAppendable
+from cleaner import HtmlCleaner, html_to_text
+from calibre_sync import sync_epubs
+from fulltext import create_index, index_statement
+from browser_server import connect_or_launch, disconnect
+from urls import canonical_url, same_page
+from similarity import RepeatDetector, near_placeholder, simhash
 
 # Persistence configuration
 BASE_DIR = os.path.expanduser("~/github/knowledge")
 os.makedirs(BASE_DIR, exist_ok=True)
 DB_PATH = os.path.join(BASE_DIR, "novels_digest.db")
+# Saved Playwright cookies and local storage, one file per site
+STATE_DIR = os.path.join(BASE_DIR, "browser_state")
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36"
+
+# Shared keep-alive session for static pages, created on first use
+_http = None
+_http_lock = threading.Lock()
+
+# 'Next' link heuristics in default order: (name and Playwright selector, static CSS
+# selector, text the static link must contain). Button-only ones have no static form.
+NEXT_LINK_HEURISTICS = [
+    ("a[rel='next']", "a[rel='next']", None),
+    ("[title*='ext chapter']", "[title*='ext chapter']", None),
+    ("[title*='ext Chapter']", "[title*='ext Chapter']", None),
+    ("a.next_page", "a.next_page", None),
+    ("a.next-page", "a.next-page", None),
+    ("a:has-text('Next')", "a", "next"),
+    ("button:has-text('Next')", None, None), # Added button support
+    ("a:has-text('下一章')", "a", "下一章"),
+    ("a:has-text('Next Chapter')", "a", "next chapter"),
+    ("button:has-text('Next Chapter')", None, None),
+]
+
+# Nodes removed from every chapter before it is stored
+CHAPTER_CLEANER = HtmlCleaner([
+    "script", "style", "iframe", "ins", "button", 
+    ".chapter-nav", ".ads", ".sharedaddy", ".wpcnt",
+    "nav", "header", "footer"
+])
+
+# Connect to the long-lived Firefox of browser_server.py instead of launching one per run
+USE_BROWSER_SERVER = True
+
+# Adaptive per-host request pacing shared by all crawler threads (and saved between runs)
+PACING = HostRateLimiter()
+# Browser readiness waits with per-host adaptive timeouts and a histogram of where time goes
+READINESS = Readiness()
+
+# Resource types the browser skips by default; the content selector never needs them
+DEFAULT_BLOCKED_TYPES = ("image", "font", "media")
+# Ad, analytics and tracker hosts (subdomains included) that are always blocked
+AD_HOSTS = (
+    "doubleclick.net", "googlesyndication.com", "googleadservices.com", "google-analytics.com",
+    "googletagmanager.com", "googletagservices.com", "adservice.google.com", "amazon-adsystem.com",
+    "adnxs.com", "taboola.com", "outbrain.com", "criteo.com", "criteo.net", "scorecardresearch.com",
+    "quantserve.com", "quantcount.com", "facebook.net", "hotjar.com", "pubmatic.com",
+    "rubiconproject.com", "moatads.com", "media.net", "ezoic.net", "ezojs.com", "adsafeprotected.com",
+    "casalemedia.com", "openx.net", "sharethrough.com", "33across.com", "yieldmo.com",
+    "chartbeat.com", "newrelic.com", "cloudflareinsights.com", "disqus.com", "stats.wp.com",
+)
+# Rough transfer sizes used to estimate what blocking saved (blocked requests are never downloaded)
+TYPICAL_BYTES = {"image": 40_000, "font": 30_000, "media": 500_000, "stylesheet": 20_000, "script": 30_000, "ad/tracker": 25_000, "other": 10_000}
 
 def init_db():
     """Initializes the database for multi-chapter books."""
-    with sqlite3.connect(DB_PATH) as conn:
+    with connect(DB_PATH) as conn:
         conn.execute("""
             CREATE TABLE IF NOT EXISTS books (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -26,10 +96,23 @@ def init_db():
             )
         """)
         # Schema migration: Add next_selector if it doesn't exist
-        try:
-            conn.execute("ALTER TABLE books ADD COLUMN next_selector TEXT")
-        except sqlite3.OperationalError:
-            pass # Column already exists
+        add_column(conn, "books", "next_selector", "TEXT")
+        # Comma-separated Playwright resource types to block, 'none' to disable
+        add_column(conn, "books", "block_resources", "TEXT")
+        # Set once the chapter previews were approved; later runs and batch mode skip them
+        add_column(conn, "books", "confirmed", "INTEGER DEFAULT 0")
+        # New chapters per run for this book in batch mode; NULL uses the run's default
+        add_column(conn, "books", "max_new", "INTEGER")
+        # Calibre's id for the book after the first sync, so later syncs skip the search
+        add_column(conn, "books", "calibre_id", "INTEGER")
+        # Highest chapter id in the last compiled EPUB; NULL forces the next compile
+        add_column(conn, "books", "compiled_watermark", "INTEGER")
+        # Why the crawler stopped fetching this book (repeated placeholder pages); NULL when active
+        add_column(conn, "books", "paused", "TEXT")
+        # Table of contents page and the CSS selector of its chapter links; when both
+        # are set, missing chapters are fetched in parallel instead of via 'Next' links
+        add_column(conn, "books", "toc_url", "TEXT")
+        add_column(conn, "books", "toc_selector", "TEXT")
         conn.execute("""
             CREATE TABLE IF NOT EXISTS chapters (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -42,79 +125,235 @@ def init_db():
                 FOREIGN KEY(book_id) REFERENCES books(id)
             )
         """)
+        # Link to the following chapter, saved so resuming never has to reload stored pages
+        add_column(conn, "chapters", "next_url", "TEXT")
+        # chapters.url is already indexed through its UNIQUE constraint
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_chapters_book_order ON chapters(book_id, chapter_order)")
+        # urls.canonical_url() of the chapter URL, so variants of a stored URL are recognised
+        add_column(conn, "chapters", "canonical_url", "TEXT")
+        # content_hash() of the cleaned chapter, to spot the same page under another URL
+        add_column(conn, "chapters", "content_hash", "TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_chapters_canonical ON chapters(canonical_url)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_chapters_book_hash ON chapters(book_id, content_hash)")
+        # similarity.simhash() of the cleaned text, and whether it looked like a placeholder page
+        add_column(conn, "chapters", "simhash", "INTEGER")
+        add_column(conn, "chapters", "flagged", "INTEGER DEFAULT 0")
+        # URL of the stored chapter this one repeats; such rows only keep the link to the next chapter
+        add_column(conn, "chapters", "duplicate_of", "TEXT")
+        # HTTP validators from the last revalidation, sent back as If-None-Match / If-Modified-Since
+        add_column(conn, "chapters", "etag", "TEXT")
+        add_column(conn, "chapters", "last_modified", "TEXT")
+        add_column(conn, "chapters", "revalidated_at", "TIMESTAMP")
+        # Earlier versions of chapters that were revised after they were stored
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS chapter_revisions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chapter_id INTEGER,
+                title TEXT,
+                html_content TEXT,
+                content_hash TEXT,
+                replaced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_chapter_revisions_chapter ON chapter_revisions(chapter_id)")
+        conn.executemany(
+            "UPDATE chapters SET canonical_url = ? WHERE id = ?",
+            [(canonical_url(url), row_id) for row_id, url in conn.execute("SELECT id, url FROM chapters WHERE canonical_url IS NULL")]
+        )
+        # Chapters contained in each book's last compiled EPUB, in spine order
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS epub_chapters (
+                book_id INTEGER,
+                position INTEGER,
+                chapter_id INTEGER,
+                content_hash TEXT,
+                file_name TEXT,
+                title TEXT,
+                PRIMARY KEY (book_id, position)
+            )
+        """)
+        # How often each 'Next' heuristic found the link, per site and book
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS next_link_strategies (
+                host TEXT,
+                book_id INTEGER,
+                strategy TEXT,
+                hits INTEGER DEFAULT 0,
+                misses INTEGER DEFAULT 0,
+                PRIMARY KEY (host, book_id, strategy)
+            )
+        """)
+        # Which fetch backend works for each site, learned during crawls
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS site_backends (
+                host TEXT PRIMARY KEY,
+                backend TEXT,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        # Fingerprints of placeholder pages (locks, login walls) learned when a book was paused
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS placeholder_fingerprints (
+                simhash INTEGER PRIMARY KEY,
+                sample TEXT,
+                added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        # Per-stage timings of every chapter fetch, read by the report command
+        create_metrics_table(conn)
+        # Full-text index of chapter text, searched with fulltext.py
+        create_index(conn, "chapters")
 
 def clean_html_content(raw_html):
     """Strips out structural navigation nodes, ads, and code scripts."""
-    soup = BeautifulSoup(raw_html, "html.parser")
-    garbage_selectors = [
-        "script", "style", "iframe", "ins", "button", 
-        ".chapter-nav", ".ads", ".sharedaddy", ".wpcnt",
-        "nav", "header", "footer"
-    ]
-    for selector in garbage_selectors:
-        for tag in soup.select(selector):
-            tag.decompose()
-    return str(soup)
+    return CHAPTER_CLEANER.clean(raw_html)
+
+def content_hash(pristine_html):
+    """Fingerprints a cleaned chapter's text; markup and whitespace changes do not count."""
+    text = " ".join(html_to_text(pristine_html).split())
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
 
 def sync_with_calibre(book_title, epub_path):
-    """Forces Calibre catalog engine to pick up binary file layout shifts."""
-    print(f"Syncing '{book_title}' with Calibre library...")
+    """Pushes one book's EPUB to Calibre, reusing the Calibre id cached in books.calibre_id."""
+    return sync_epubs(DB_PATH, [(book_title, epub_path)], id_table="books")
+
+def with_view_adult(url):
+    """Smart AO3 handling: appends view_adult=true (before any fragment) so content is visible."""
+    if "archiveofourown.org" in url and "view_adult=true" not in url:
+        base_part, *fragment = url.split("#")
+        sep = "&" if "?" in base_part else "?"
+        url = f"{base_part}{sep}view_adult=true"
+        if fragment:
+            url += f"#{fragment[0]}"
+    return url
+
+def resolve_next_href(href, current_url):
+    """Turns a 'Next' href into an absolute URL, or None if it points back at the current page."""
+    new_url = with_view_adult(urljoin(current_url, href))
+
+    return None if same_page(new_url, current_url) else new_url
+
+def next_link_heuristics(next_selector=None):
+    """A configured next_selector replaces the built-in heuristics."""
+    if next_selector:
+        return [(next_selector, next_selector, None)]
+    return NEXT_LINK_HEURISTICS
+
+def get_static_next_url(soup, current_url, next_selector=None):
+    """Finds the 'Next' link in already downloaded HTML, mirroring get_next_url's heuristics."""
+    return find_static_next_link(soup, current_url, next_link_heuristics(next_selector))[0]
+
+def find_static_next_link(soup, current_url, heuristics):
+    """Tries `heuristics` in order on parsed HTML; returns (next_url, heuristic name) or (None, None).
+
+    Only real links count: 'Next' buttons need a browser to click.
+    """
+    for name, css, text_filter in heuristics:
+        if css is None:
+            continue
+        try:
+            elements = soup.select(css)
+        except Exception:
+            continue
+        for el in elements:
+            text = el.get_text().lower()
+            href = el.get("href")
+            if text_filter and text_filter not in text:
+                continue
+            if not href or any(x in text for x in ["prev", "back", "上一章"]):
+                continue
+            if any(x in href.lower() for x in ["prev", "back"]):
+                continue
+            new_url = resolve_next_href(href, current_url)
+            if new_url:
+                return new_url, name
+    return None, None
+
+def http_session():
+    """Returns the shared keep-alive HTTP session used for static chapter fetches."""
+    global _http
+    with _http_lock:
+        if _http is None:
+            _http = requests.Session()
+            _http.headers["User-Agent"] = USER_AGENT
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16)
+            _http.mount("http://", adapter)
+            _http.mount("https://", adapter)
+    return _http
+
+def fetch_static(url, selector, next_selector=None, heuristics=None, metrics=None):
+    """Fetches a chapter with a plain HTTP GET instead of the browser.
+
+    Returns (title, content_html, next_url, next_heuristic), or None when the page
+    loaded but is unusable without JavaScript (`selector` matched nothing but
+    whitespace). Network errors and non-200 answers raise requests exceptions:
+    they are failures of this chapter, not proof the site needs a browser.
+    `heuristics` overrides the order 'Next' links are looked for in.
+    Time spent is added to the ChapterMetrics `metrics`, if given.
+    """
+    metrics = metrics or ChapterMetrics(None, url, None)
+    stats = {}
     try:
-        # Don't use check=True here because exit code 1 means "no results"
-        search_cmd = ["calibredb", "search", f"title:\"{book_title}\""]
-        result = subprocess.run(search_cmd, capture_output=True, text=True)
-        book_ids = result.stdout.strip()
-
-        if book_ids and result.returncode == 0:
-            book_id = book_ids.split(',')[0]
-            print(f"Updating existing Calibre Book Entry ID: {book_id}")
-            add_cmd = ["calibredb", "add_format", book_id, epub_path]
-            subprocess.run(add_cmd, check=True)
-        else:
-            print(f"Adding '{book_title}' to Calibre as a brand new catalog item...")
-            add_cmd = ["calibredb", "add", epub_path]
-            subprocess.run(add_cmd, check=True)
-            
-        print("Calibre database successfully refreshed.")
-    except FileNotFoundError:
-        print("\n[Warning]: 'calibredb' command utility was not found in system PATH.")
-    except subprocess.CalledProcessError as e:
-        stderr_msg = e.stderr if e.stderr else str(e)
-        if "Another calibre program" in stderr_msg:
-            print("\n[Error]: Calibre database is locked because the Calibre desktop app is open.")
-            print("Please close Calibre and run the script again to sync.")
-        else:
-            print(f"Failed Calibre sync (Command failed): {stderr_msg}")
-    except Exception as e:
-        print(f"Failed Calibre sync: {e}")
+        response = polite_get(PACING, url, session=http_session(), stats=stats, timeout=30)
+    except requests.RequestException:
+        metrics.add("pacing", stats["pacing"])
+        metrics.add("http_fetch", stats["fetch"], retries=stats["retries"])
+        raise
+    metrics.add("pacing", stats["pacing"])
+    metrics.add("http_fetch", stats["fetch"], len(response.content), stats["retries"])
+    if response.status_code in THROTTLE_STATUSES:
+        # Still throttled after backing off; the browser would only be throttled too
+        raise requests.HTTPError(f"{response.status_code} from {url} after repeated backoff", response=response)
+    if response.status_code != 200:
+        raise requests.HTTPError(f"{response.status_code} from {url}", response=response)
+
+    with metrics.span("static_parse"):
+        soup = BeautifulSoup(response.text, "html.parser")
+        content = soup.select_one(selector)
+        if content is None or not content.get_text().strip():
+            return None
+        title = soup.title.get_text().strip() if soup.title else ""
+    with metrics.span("next_link"):
+        next_url, heuristic = find_static_next_link(soup, url, heuristics or next_link_heuristics(next_selector))
+    return title, content.decode_contents(), next_url, heuristic
+
+def browser_may_help(error, backend):
+    """Whether a failed plain HTTP fetch is worth retrying in the browser.
+
+    Only on hosts not yet proven to work over HTTP (a bot check may answer plain
+    requests with 403), and never when throttled. Decides nothing for the host.
+    """
+    status = error.response.status_code if error.response is not None else None
+    return backend != "http" and status not in THROTTLE_STATUSES
+
+def get_site_backend(host):
+    """Returns the remembered fetch backend ('http' or 'browser') for a host, if any."""
+    row = connect(DB_PATH).execute("SELECT backend FROM site_backends WHERE host = ?", (host,)).fetchone()
+    return row[0] if row else None
+
+def set_site_backend(host, backend):
+    with connect(DB_PATH) as conn:
+        conn.execute(
+            "INSERT INTO site_backends (host, backend) VALUES (?, ?) "
+            "ON CONFLICT(host) DO UPDATE SET backend = excluded.backend, updated_at = CURRENT_TIMESTAMP",
+            (host, backend)
+        )
 
 def get_next_url(page, current_url, next_selector=None):
     """Extracts the 'Next' link using common selectors, avoiding 'Previous' links."""
-    candidates = []
-    if next_selector:
-        candidates.append(page.locator(next_selector))
-    else:
-        # Ordered list of heuristics
-        candidates = [
-            page.locator("a[rel='next']"),
-            page.locator("[title*='ext chapter']"), 
-            page.locator("[title*='ext Chapter']"),
-            page.locator("a.next_page"),
-            page.locator("a.next-page"),
-            page.locator("a:has-text('Next')"),
-            page.locator("button:has-text('Next')"), # Added button support
-            page.locator("a:has-text('下一章')"),
-            page.locator("a:has-text('Next Chapter')"),
-            page.locator("button:has-text('Next Chapter')")
-        ]
+    return find_next_link(page, current_url, next_link_heuristics(next_selector))[0]
+
+def find_next_link(page, current_url, heuristics):
+    """Tries `heuristics` in order on the live page; returns (next_url, heuristic name) or (None, None)."""
+    candidates = [(name, page.locator(name)) for name, _, _ in heuristics]
     
-    for candidate_locator in candidates:
+    for name, candidate_locator in candidates:
         try:
             count = candidate_locator.count()
             for i in range(count):
                 el = candidate_locator.nth(i)
-                # Be more patient for SPA buttons
-                if el.is_visible(timeout=10000):
+                # The page is already ready (see READINESS), so this check is instant
+                if el.is_visible():
                     text = el.inner_text().lower()
                     href = el.get_attribute("href")
                     
@@ -125,269 +364,1473 @@ def get_next_url(page, current_url, next_selector=None):
                         continue
                         
                     if href:
-                        parsed_url = urlparse(current_url)
-                        base_domain = f"{parsed_url.scheme}://{parsed_url.netloc}"
-                        new_url = base_domain + href if href.startswith("/") else href
-                        
-                        # Smart AO3 handling: Append view_adult=true to ensure content is visible
-                        if "archiveofourown.org" in new_url and "view_adult=true" not in new_url:
-                            base_part, *fragment = new_url.split("#")
-                            sep = "&" if "?" in base_part else "?"
-                            new_url = f"{base_part}{sep}view_adult=true"
-                            if fragment:
-                                new_url += f"#{fragment[0]}"
-
-                        # Strip fragments for comparison
-                        clean_new = new_url.split("#")[0].split("?")[0]
-                        clean_current = current_url.split("#")[0].split("?")[0]
-                        
-                        if clean_new != clean_current:
+                        new_url = resolve_next_href(href, current_url)
+                        if new_url:
                             print(f"  [Debug] Found Next Link: {new_url}")
-                            return new_url
+                            return new_url, name
                     else:
                         # Handle SPA click
                         print(f"  [Debug] Found Next Button (SPA Click)")
                         old_url = page.url
                         el.click()
-                        # Wait for URL to change OR some time to pass
+                        # Wait for URL to change OR as long as this host usually needs
                         try:
-                            page.wait_for_url(lambda url: url != old_url, timeout=10000)
-                            return page.url
+                            page.wait_for_url(lambda url: url != old_url, timeout=READINESS.timeout(current_url) * 1000)
+                            return page.url, name
                         except Exception:
                             # If URL didn't change, return anyway as it might have loaded content
-                            return page.url
+                            return page.url, name
         except Exception:
             continue
             
-    return None
+    return None, None
+
+def handle_ao3_gate(page):
+    """Passes AO3's TOS prompt and adult-content gate if the loaded page shows them.
+
+    Only checks what is already in the DOM after domcontentloaded, so pages without
+    a gate cost nothing. Returns True if a gate was passed, meaning the context's
+    cookies are worth saving (see LazyPage.save_state).
+    """
+    passed = False
+    try:
+        tos_check = page.locator("#tos_agree")
+        if tos_check.count() > 0 and tos_check.is_visible():
+            print("  [Debug] AO3 TOS Gate detected. Accepting...")
+            tos_check.check(force=True)
+            data_check = page.locator("#data_processing_agree")
+            if data_check.count() > 0:
+                data_check.check(force=True)
+            accept_btn = page.locator("#accept_tos")
+            if accept_btn.count() > 0:
+                accept_btn.click(timeout=5000, force=True)
+                passed = True
+
+        proceed_btn = page.locator("input[name='commit'][value='Proceed']")
+        if proceed_btn.count() > 0 and proceed_btn.is_visible():
+            print("  [Debug] AO3 Age Gate detected. Proceeding...")
+            # The button submits a form; wait for the chapter it leads to rather than a fixed delay
+            with page.expect_navigation(wait_until="domcontentloaded", timeout=30000):
+                proceed_btn.click(timeout=5000, force=True)
+            passed = True
+    except Exception as e:
+        print(f"  [Debug] AO3 Gate error: {e}")
+    return passed
+
+def goto_with_retry(page, url, max_retries=3, metrics=None):
+    """Navigates to `url`, retrying timeouts and 429/503 answers a few times before giving up.
+
+    Every attempt is reported to PACING, whose backoff replaces a fixed retry delay.
+    Pacing and navigation time go to the ChapterMetrics `metrics`, if given.
+    """
+    metrics = metrics or ChapterMetrics(None, url, None)
+    for attempt in range(max_retries):
+        metrics.add("pacing", PACING.wait(url))
+        start = time.monotonic()
+        try:
+            response = page.goto(url, wait_until="domcontentloaded", timeout=60000)
+        except Exception as e:
+            metrics.add("navigation", time.monotonic() - start, retries=1 if attempt else 0)
+            PACING.record(url, None, time.monotonic() - start)
+            if attempt < max_retries - 1:
+                print(f"  [Warning] Timeout fetching {url}, retrying ({attempt + 1}/{max_retries})...")
+                continue
+            raise e
+        status = response.status if response else 200
+        headers = response.headers if response else {}
+        size = headers.get("content-length", "")
+        metrics.add(
+            "navigation", time.monotonic() - start, int(size) if size.isdigit() else 0, retries=1 if attempt else 0
+        )
+        PACING.record(url, status, time.monotonic() - start, headers.get("retry-after"))
+        if status not in THROTTLE_STATUSES:
+            return
+        if attempt < max_retries - 1:
+            print(f"  [Warning] {url} answered {status}, retrying ({attempt + 1}/{max_retries})...")
+        else:
+            raise RuntimeError(f"{url} answered {status} after {max_retries} attempts")
+
+class ResourceBlocker:
+    """Aborts browser requests the cleaned chapter never uses and counts what was skipped.
+
+    Attached to a context with context.route(). Blocks the given Playwright
+    resource types plus any request to a known ad/tracker host.
+    """
 
-def scrape_incremental(book_id, start_url, selector, next_selector=None, max_new=500):
-    """Scrapes new chapters starting from the provided URL."""
+    def __init__(self, blocked_types=DEFAULT_BLOCKED_TYPES):
+        self.blocked_types = set(blocked_types)
+        self.blocked = Counter()
+
+    def attach(self, context):
+        context.route("**/*", self.handle)
+
+    def handle(self, route):
+        request = route.request
+        host = urlparse(request.url).hostname or ""
+        if request.resource_type in self.blocked_types:
+            kind = request.resource_type
+        elif any(host == ad or host.endswith("." + ad) for ad in AD_HOSTS):
+            kind = "ad/tracker"
+        else:
+            route.continue_()
+            return
+        self.blocked[kind] += 1
+        route.abort()
+
+    def report(self):
+        """Prints how many requests were blocked and roughly how many bytes that saved."""
+        total = sum(self.blocked.values())
+        if not total:
+            return
+        saved_kb = sum(TYPICAL_BYTES.get(kind, TYPICAL_BYTES["other"]) * n for kind, n in self.blocked.items()) // 1024
+        breakdown = ", ".join(f"{kind}: {n}" for kind, n in self.blocked.most_common())
+        print(f"  [Debug] Blocked {total} requests ({breakdown}), roughly {saved_kb} KB not downloaded.")
+
+def parse_blocked_types(value):
+    """Reads a book's block_resources setting: NULL/empty -> defaults, 'none' -> block nothing."""
+    if not value or not value.strip():
+        return DEFAULT_BLOCKED_TYPES
+    if value.strip().lower() == "none":
+        return ()
+    return tuple(part.strip() for part in value.split(",") if part.strip())
+
+class NextLinkStrategies:
+    """Learns which 'Next' heuristic works for a book's site and tries it first.
+
+    Hits and misses are counted per (host, book) in memory and written to the
+    next_link_strategies table by save(). A heuristic that was tried first and
+    failed while another one succeeded is demoted by a miss.
+    """
+
+    def __init__(self, book_id, next_selector=None):
+        self.book_id = book_id
+        # A configured selector is already the concrete answer; nothing to learn
+        self.fixed = next_link_heuristics(next_selector) if next_selector else None
+        self.scores = {}  # (host, name) -> [hits, misses]
+        self.loaded = set()
+        self.dirty = set()
+
+    def _load(self, host):
+        if host in self.loaded:
+            return
+        self.loaded.add(host)
+        rows = connect(DB_PATH).execute(
+            "SELECT strategy, hits, misses FROM next_link_strategies WHERE host = ? AND book_id = ?",
+            (host, self.book_id)
+        ).fetchall()
+        if not rows:
+            # New book on a known site: start from what other books there learned
+            rows = connect(DB_PATH).execute(
+                "SELECT strategy, SUM(hits), SUM(misses) FROM next_link_strategies WHERE host = ? GROUP BY strategy",
+                (host,)
+            ).fetchall()
+        for name, hits, misses in rows:
+            self.scores[(host, name)] = [hits, misses]
+
+    def order(self, url):
+        """Returns the heuristics for `url`, best-scoring first (stable for ties)."""
+        if self.fixed:
+            return self.fixed
+        host = urlparse(url).netloc
+        self._load(host)
+
+        def rank(heuristic):
+            hits, misses = self.scores.get((host, heuristic[0]), (0, 0))
+            return -(hits - 2 * misses)
+        return sorted(NEXT_LINK_HEURISTICS, key=rank)
+
+    def record(self, url, tried_first, winner):
+        """Counts a hit for `winner` and a miss for the first heuristic if it did not win."""
+        if self.fixed:
+            return
+        host = urlparse(url).netloc
+        if winner:
+            self.scores.setdefault((host, winner), [0, 0])[0] += 1
+            self.dirty.add((host, winner))
+        if tried_first and tried_first != winner:
+            self.scores.setdefault((host, tried_first), [0, 0])[1] += 1
+            self.dirty.add((host, tried_first))
+
+    def save(self):
+        if not self.dirty:
+            return
+        with connect(DB_PATH) as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO next_link_strategies (host, book_id, strategy, hits, misses) VALUES (?, ?, ?, ?, ?)",
+                [(host, self.book_id, name, *self.scores[(host, name)]) for host, name in self.dirty]
+            )
+        self.dirty.clear()
+
+def launch_browser(playwright):
+    """Returns the shared browser server's Firefox, or a freshly launched private one."""
+    if USE_BROWSER_SERVER:
+        return connect_or_launch(playwright)
+    return playwright.firefox.launch(headless=True)
+
+def storage_state_path(url):
+    """Where the browser cookies for the site of `url` are kept between runs."""
+    return os.path.join(STATE_DIR, f"{urlparse(url).netloc}.json")
+
+class LazyPage:
+    """Opens a Playwright page only once a chapter actually needs a browser.
+
+    `browser` may be a launched browser or a zero-argument callable returning one;
+    without it Firefox comes from launch_browser() on demand and is closed (or,
+    for the shared browser server, disconnected) in close().
+    An optional ResourceBlocker is attached to the context when it is created.
+    The context starts from the cookies saved at `state_path`, if any, so
+    consent and age gates passed on an earlier run stay passed.
+    """
+
+    def __init__(self, browser=None, blocker=None, state_path=None):
+        self.browser = browser
+        self.blocker = blocker
+        self.state_path = state_path
+        self.playwright = None
+        self.context = None
+        self.page = None
+
+    def get(self):
+        if self.page is None:
+            if self.browser is None:
+                self.playwright = sync_playwright().start()
+                self.browser = launch_browser(self.playwright)
+            elif callable(self.browser):
+                self.browser = self.browser()
+            saved_state = self.state_path if self.state_path and os.path.exists(self.state_path) else None
+            self.context = self.browser.new_context(user_agent=USER_AGENT, storage_state=saved_state)
+            if self.blocker:
+                self.blocker.attach(self.context)
+            self.page = self.context.new_page()
+        return self.page
+
+    def new_page(self):
+        """Opens another tab in the same context, sharing its cookies and resource blocking."""
+        self.get()
+        return self.context.new_page()
+
+    def save_state(self):
+        """Writes the context's cookies and local storage to `state_path`."""
+        if not (self.context and self.state_path):
+            return
+        state = self.context.storage_state()
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        tmp_path = f"{self.state_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        # Workers on the same site may save at once; each replace is atomic
+        os.replace(tmp_path, self.state_path)
+        print(f"  [Debug] Saved browser cookies to {self.state_path}")
+
+    def close(self):
+        if self.context:
+            self.context.close()
+            if self.blocker:
+                self.blocker.report()
+        if self.playwright:
+            if self.browser:  # None when the launch itself failed
+                disconnect(self.browser)
+            self.playwright.stop()
+
+def confirm_preview(number, page_title, pristine_html):
+    """Shows the start of a cleaned chapter and asks whether the selectors got it right."""
+    text_preview = html_to_text(pristine_html).strip()
+    print("\n" + "="*50)
+    print(f"PREVIEW (Chapter {number}): {page_title}")
+    print("-" * 50)
+    print(text_preview[:400] + "...")
+    print("="*50)
+    confirm = input(f"\nDoes preview {number} look correct? (y/n): ").strip().lower()
+    return confirm == 'y'
+
+class ChapterStore:
+    """Cleans, compresses, indexes and inserts a book's chapters on a worker thread.
+
+    Storing overlaps with loading other pages (in TOC mode). Every write of a crawl goes
+    through the one thread, whose BatchWriter commits in batches; call close()
+    to flush it. A chapter whose cleaned text matches one already stored for
+    the book is stored with `duplicate_of` set, which keeps it out of the book
+    and the search index. Unless it repeats one of the last few chapters (see
+    RepeatDetector), `duplicate` then holds (url, url of the original).
+    Chapters that look like a placeholder page are stored flagged (and left out
+    of the EPUB); when several recent ones do, the book is paused and `paused`
+    holds the reason. Chapters that fail to store are listed in `failed`.
+    """
+
+    def __init__(self, book_id):
+        self.book_id = book_id
+        self.thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chapter-store")
+        self.writer = self.thread.submit(lambda: BatchWriter(connect(DB_PATH))).result()
+        self.failed = []  # (url, error) of chapters that could not be stored
+        self.hashes = {}  # content hash -> url, for chapters not flushed yet
+        self.duplicate = None
+        self.skipped = 0
+        conn = connect(DB_PATH)
+        recent = conn.execute(
+            "SELECT simhash, url FROM chapters WHERE book_id = ? AND simhash IS NOT NULL "
+            "ORDER BY chapter_order DESC LIMIT 6", (book_id,)
+        ).fetchall()
+        self.repeats = RepeatDetector(
+            [row[0] for row in conn.execute("SELECT simhash FROM placeholder_fingerprints")], reversed(recent)
+        )
+        self.paused = None
+
+    def _store(self, url, title, raw_html, pristine_html, order, next_url, metrics):
+        if pristine_html is None:
+            with metrics.span("clean"):
+                pristine_html = clean_html_content(raw_html)
+        with metrics.span("store"):
+            digest = content_hash(pristine_html)
+            key = canonical_url(url)
+            conn = connect(DB_PATH)
+            original = self.hashes.get(digest) or conn.execute(
+                "SELECT url FROM chapters WHERE book_id = ? AND content_hash = ? AND canonical_url != ? "
+                "AND duplicate_of IS NULL LIMIT 1",
+                (self.book_id, digest, key)
+            ).fetchone()
+            if original and not isinstance(original, str):
+                original = original[0]
+            if not original:
+                self.hashes[digest] = url
+            # A repeat of one of the last few chapters is the site serving one page again, which
+            # the repeat check below judges; a repeat of an older chapter means the links looped back
+            recent_repeat = original and any(entry[1] == original for entry in self.repeats.recent)
+            text = " ".join(html_to_text(pristine_html).split())
+            fingerprint = simhash(text)
+            placeholder, repeated = self.repeats.check(fingerprint, url)
+            html_content = compress_html(DB_PATH, pristine_html, f"book:{self.book_id}")
+            flagged = 1 if placeholder or repeated else 0
+            replaced = conn.execute(
+                "SELECT id FROM chapters WHERE book_id = ? AND canonical_url = ? AND flagged = 1", (self.book_id, key)
+            ).fetchone()
+            if replaced:
+                # A flagged chapter fetched again keeps its row and place in the book
+                self.writer.add(
+                    "UPDATE chapters SET url = ?, title = ?, html_content = ?, next_url = ?, content_hash = ?, "
+                    "simhash = ?, flagged = ?, duplicate_of = ? WHERE id = ?",
+                    (url, title, html_content, next_url, digest, fingerprint, flagged, original, replaced[0])
+                )
+                self.writer.add("UPDATE books SET compiled_watermark = NULL WHERE id = ?", (self.book_id,))
+            else:
+                self.writer.add(
+                    "INSERT INTO chapters (book_id, url, title, html_content, chapter_order, next_url, canonical_url, "
+                    "content_hash, simhash, flagged, duplicate_of) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (self.book_id, url, title, html_content, order, next_url, key, digest, fingerprint, flagged, original)
+                )
+            if original:
+                # Stored with its link so later runs pass it, but not counted, indexed or compiled
+                print(f"  [Warning] {url} repeats {original}, kept out of the book.")
+                self.skipped += 1
+                if not (recent_repeat or placeholder):
+                    self.duplicate = (url, original)
+            elif placeholder:
+                print(f"  [Warning] {url} looks like a placeholder page, flagged.")
+            for other in repeated:
+                if other != url:
+                    self.writer.add("UPDATE chapters SET flagged = 1 WHERE url = ?", (other,))
+            if repeated and not self.paused:
+                self.paused = f"{len(repeated)} recent chapters are the same page (last: {url})"
+                print(f"  [Warning] Pausing the book: {self.paused}.")
+                self.writer.add("UPDATE books SET paused = ? WHERE id = ?", (self.paused, self.book_id))
+                # Other books on such sites get flagged on the first hit
+                self.writer.add(
+                    "INSERT OR IGNORE INTO placeholder_fingerprints (simhash, sample) VALUES (?, ?)",
+                    (fingerprint, text[:200])
+                )
+        if not original:
+            with metrics.span("index"):
+                self.writer.add(*index_statement("chapters", title, pristine_html, url))
+        metrics.write(self.writer)
+
+    def _store_or_record(self, url, *args):
+        try:
+            self._store(url, *args)
+        except Exception as e:
+            print(f"  [Error] Could not store {url}: {e}")
+            self.failed.append((url, e))
+
+    def add(self, url, title, raw_html, pristine_html, order, next_url, metrics):
+        """Queues a fetched chapter; `pristine_html` is its cleaned HTML if already known.
+
+        A chapter that cannot be stored ends up in `failed` instead of raising here.
+        """
+        self.thread.submit(self._store_or_record, url, title, raw_html, pristine_html, order, next_url, metrics)
+
+    def wait(self):
+        """Blocks until the queued chapters are stored, so `duplicate` and `paused` are up to date."""
+        self.thread.submit(lambda: None).result()
+
+    def execute(self, sql, params=()):
+        self.thread.submit(self.writer.add, sql, params)
+
+    def write_metrics(self, metrics):
+        self.thread.submit(metrics.write, self.writer)
+
+    def close(self):
+        """Flushes the pending writes and reports the chapters that could not be stored."""
+        try:
+            self.thread.submit(self.writer.flush).result()
+        finally:
+            self.thread.submit(close_all)
+            self.thread.shutdown()
+            if self.failed:
+                url, error = self.failed[0]
+                print(f"[Error]: {len(self.failed)} chapter(s) were not stored, first {url}: {error}")
+
+def scrape_incremental(book_id, start_url, selector, next_selector=None, max_new=500, browser=None, preview=True):
+    """Scrapes new chapters starting from the provided URL.
+
+    Static sites are read with plain HTTP requests; the browser is only used for
+    hosts that need JavaScript, and the choice is remembered per host. Chapters
+    are cleaned and stored on a worker thread, which is waited for before the
+    next page loads: a repeated or placeholder page must stop the crawl without
+    another request. Request spacing is left to the shared PACING rate limiter.
+    Pass `browser` (see LazyPage) to reuse an existing Firefox; each book gets
+    its own context. Previews are shown only for books not yet confirmed; set
+    `preview=False` for unattended runs that cannot answer prompts.
+    """
     new_chapters_count = 0
     current_url = start_url
     visited_this_session = set()
     
+    conn = connect(DB_PATH)
+    toc = conn.execute("SELECT toc_url, toc_selector, paused, title FROM books WHERE id = ?", (book_id,)).fetchone()
+    if toc and toc[2]:
+        print(f"[Warning]: '{toc[3]}' is paused ({toc[2]}). Run 'python3 crawler.py unpause {book_id}' once the site is fixed.")
+        return 0
+    if toc and toc[0] and toc[1]:
+        return scrape_toc(book_id, toc[0], toc[1], selector, max_new, browser, preview)
+
+    store = ChapterStore(book_id)
+
     # Find current max order
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.execute("SELECT MAX(chapter_order) FROM chapters WHERE book_id = ?", (book_id,))
-        max_order = cursor.fetchone()[0] or 0
-
-    with sync_playwright() as p:
-        browser = p.firefox.launch(headless=True)
-        context = browser.new_context(
-            user_agent="Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36"
-        )
-        page = context.new_page()
+    cursor = conn.execute("SELECT MAX(chapter_order) FROM chapters WHERE book_id = ?", (book_id,))
+    max_order = cursor.fetchone()[0] or 0
 
-        def handle_ao3_gate(page):
-            """Checks for and bypasses AO3 age/tos gate in a loop to handle sequential gates."""
-            for _ in range(3):  # Try up to 3 times to handle multiple sequential gates
-                gate_found = False
-                try:
-                    # 1. Handle TOS/Consent Gate
-                    # Wait briefly to see if the gate appears
-                    try:
-                        page.wait_for_selector("#tos_agree", timeout=3000, state="visible")
-                    except Exception:
-                        pass # Might not be on this page
+    book_settings = conn.execute("SELECT block_resources, confirmed FROM books WHERE id = ?", (book_id,)).fetchone()
+    blocked_types = parse_blocked_types(book_settings[0] if book_settings else None)
+    if preview and book_settings and book_settings[1]:
+        print("  [Debug] Selectors were confirmed before, skipping previews.")
+        preview = False
+    pages = LazyPage(browser, ResourceBlocker(blocked_types), storage_state_path(start_url))
 
-                    tos_check = page.locator("#tos_agree")
-                    data_check = page.locator("#data_processing_agree")
-                    
-                    if tos_check.count() > 0 and tos_check.is_visible():
-                        print("  [Debug] AO3 TOS Gate detected. Accepting...")
-                        tos_check.check(force=True)
-                        if data_check.count() > 0:
-                            data_check.check(force=True)
-                        
-                        accept_btn = page.locator("#accept_tos")
-                        if accept_btn.count() > 0:
-                            accept_btn.click(timeout=5000, force=True)
-                            page.wait_for_load_state("domcontentloaded")
-                            gate_found = True
-                    
-                    # 2. Handle Adult Content / Age Gate
-                    try:
-                        page.wait_for_selector("input[value='Proceed']", timeout=2000, state="visible")
-                    except Exception:
-                        pass
-
-                    proceed_btn = page.locator("input[name='commit'][value='Proceed']")
-                    if proceed_btn.count() > 0 and proceed_btn.is_visible():
-                        print("  [Debug] AO3 Age Gate detected. Proceeding...")
-                        proceed_btn.click(timeout=5000, force=True)
-                        page.wait_for_load_state("domcontentloaded")
-                        gate_found = True
-                    
-                    if not gate_found:
-                        break # No gates visible, proceed to content
-                    
-                    print("  [Debug] Gate bypassed, waiting for content to settle...")
-                    time.sleep(2) # Give the page 2 seconds to settle after a click
-                except Exception as e:
-                    print(f"  [Debug] AO3 Gate loop error: {e}")
-                    break
-        
+    strategies = NextLinkStrategies(book_id, next_selector)
+
+    def browser_next_url(page, url):
+        """get_next_url with the heuristics that worked before on this site tried first."""
+        heuristics = strategies.order(url)
+        next_url, winner = find_next_link(page, url, heuristics)
+        if winner:
+            strategies.record(url, heuristics[0][0], winner)
+        return next_url
+
+    def fetch_over_http(url, metrics):
+        """Tries the HTTP path for `url`; returns (title, html, next_url, heuristic) or None to use the browser."""
+        host = urlparse(url).netloc
+        backend = get_site_backend(host)
+        if backend == "browser":
+            return None
+        heuristics = strategies.order(url)
+        try:
+            fetched = fetch_static(url, selector, next_selector, heuristics, metrics)
+        except requests.RequestException as e:
+            if not browser_may_help(e, backend):
+                raise
+            print(f"  [Debug] HTTP fetch failed ({e}), trying the browser for this page.")
+            return None
+        if fetched and fetched[3]:
+            # Buttons cannot be tried without a browser, so the first link heuristic is what lost
+            strategies.record(url, next(name for name, css, _ in heuristics if css), fetched[3])
+        if fetched is None:
+            print(f"  [Debug] {host} needs a browser, remembering that.")
+            set_site_backend(host, "browser")
+            return None
+        if fetched[2] is None and backend != "http":
+            # Unproven host and no link found: let the browser look for a 'Next' button
+            return None
+        if backend != "http":
+            print(f"  [Debug] {host} works over plain HTTP, remembering that.")
+            set_site_backend(host, "http")
+        return fetched
+    
+    try:
         while current_url and new_chapters_count < max_new:
-            # Smart AO3 handling: Force append view_adult=true to every URL before processing
-            # Ensure it's placed before fragments (#)
-            if "archiveofourown.org" in current_url and "view_adult=true" not in current_url:
-                base_part, *fragment = current_url.split("#")
-                sep = "&" if "?" in base_part else "?"
-                current_url = f"{base_part}{sep}view_adult=true"
-                if fragment:
-                    current_url += f"#{fragment[0]}"
+            current_url = with_view_adult(current_url)
 
             # Infinite loop protection
-            if current_url in visited_this_session:
+            current_key = canonical_url(current_url)
+            if current_key in visited_this_session:
                 print(f"Loop detected at {current_url}. Stopping.")
                 break
-            visited_this_session.add(current_url)
+            visited_this_session.add(current_key)
+            # Decided by the last chapter's store, so that is waited for before loading another page
+            store.wait()
+            if store.duplicate:
+                print(f"{store.duplicate[0]} has the same content as {store.duplicate[1]}. Stopping.")
+                break
+            if store.paused:
+                print("Book paused. Stopping.")
+                break
+            if store.failed:
+                print("Storing failed. Stopping.")
+                break
 
-            # Check if URL already exists in database
-            with sqlite3.connect(DB_PATH) as conn:
-                if conn.execute("SELECT 1 FROM chapters WHERE url = ?", (current_url,)).fetchone():
-                    print(f"Chapter already in DB: {current_url}. Advancing to find next chapter...")
-                    try:
-                        # Retry logic for advancement navigation
-                        max_retries = 3
-                        for attempt in range(max_retries):
+            # Check if URL (in any variant) already exists in database
+            # Flagged chapters count as missing, so they are fetched again
+            stored = conn.execute(
+                "SELECT next_url FROM chapters WHERE canonical_url = ? AND flagged = 0", (current_key,)
+            ).fetchone()
+            if stored and stored[0]:
+                # The link was saved with the chapter, no need to load the page again
+                current_url = stored[0]
+                continue
+            # Timing spans of this chapter, stored in crawl_metrics
+            metrics = ChapterMetrics(book_id, current_url, urlparse(current_url).netloc)
+
+            if stored:
+                print(f"Chapter already in DB: {current_url}. Advancing to find next chapter...")
+                try:
+                    fetched = fetch_over_http(current_url, metrics)
+                    if fetched:
+                        next_url = fetched[2]
+                    else:
+                        metrics.backend = "browser"
+                        page = pages.get()
+                        goto_with_retry(page, current_url, metrics=metrics)
+                        with metrics.span("gate"):
+                            if handle_ao3_gate(page):
+                                pages.save_state()
+                    
+                        # The 'Next' link renders with the content, so wait for that to settle
+                        with metrics.span("readiness"):
                             try:
-                                page.goto(current_url, wait_until="domcontentloaded", timeout=60000)
-                                break
-                            except Exception as e:
-                                if attempt < max_retries - 1:
-                                    print(f"  [Warning] Timeout advancing from {current_url}, retrying ({attempt + 1}/{max_retries})...")
-                                    time.sleep(5)
-                                else:
-                                    raise e
-
-                        handle_ao3_gate(page)
-                        
-                        # Give the page more time if it's dynamic/heavy
-                        try:
-                            page.wait_for_load_state("networkidle", timeout=15000) 
-                        except Exception:
-                            print("  [Debug] Networkidle timeout (continuing anyway...)")
-                        
-                        next_url = get_next_url(page, current_url, next_selector)
-                        
-                        if not next_url:
+                                READINESS.wait(page, current_url, selector, kind="advance")
+                            except Exception:
+                                print("  [Debug] Content did not settle in time (continuing anyway...)")
+                    
+                        with metrics.span("next_link"):
+                            next_url = browser_next_url(page, current_url)
+                
+                    if not next_url:
+                        if pages.page:
                             # Diagnostic screenshot
                             diag_path = os.path.expanduser("~/github/knowledge/debug/ao3_debug.png")
                             os.makedirs(os.path.dirname(diag_path), exist_ok=True)
-                            page.screenshot(path=diag_path)
+                            pages.page.screenshot(path=diag_path)
                             print(f"  [Debug] Saved diagnostic screenshot to {diag_path}")
-                            print(f"[Error]: Could not extract 'Next' URL from existing chapter: {current_url}")
-                            print(f"Check if your Next selector '{next_selector if next_selector else '[Auto-Detect]'}' is still valid on this page.")
-                            break
-                            
-                        current_url = next_url
-                        continue
-                    except Exception as e:
-                        print(f"Could not advance from existing chapter: {e}")
+                        print(f"[Error]: Could not extract 'Next' URL from existing chapter: {current_url}")
+                        print(f"Check if your Next selector '{next_selector if next_selector else '[Auto-Detect]'}' is still valid on this page.")
                         break
+                    
+                    store.execute("UPDATE chapters SET next_url = ? WHERE canonical_url = ?", (next_url, current_key))
+                    store.write_metrics(metrics)
+                    current_url = next_url
+                    continue
+                except Exception as e:
+                    print(f"Could not advance from existing chapter: {e}")
+                    break
 
             print(f"Fetching: {current_url}")
             try:
-                # Retry logic for page navigation
-                max_retries = 3
-                for attempt in range(max_retries):
-                    try:
-                        page.goto(current_url, wait_until="domcontentloaded", timeout=60000)
-                        break
-                    except Exception as e:
-                        if attempt < max_retries - 1:
-                            print(f"  [Warning] Timeout fetching {current_url}, retrying ({attempt + 1}/{max_retries})...")
-                            time.sleep(5)
-                        else:
-                            raise e
-
-                handle_ao3_gate(page)
-                page.wait_for_selector(selector, timeout=15000)
-                
-                page_title = page.title()
-                raw_content = page.locator(selector).first.inner_html()
-                pristine_html = clean_html_content(raw_content)
+                fetched = fetch_over_http(current_url, metrics)
+                if fetched:
+                    page_title, raw_content, next_url, _ = fetched
+                else:
+                    metrics.backend = "browser"
+                    page = pages.get()
+                    goto_with_retry(page, current_url, metrics=metrics)
+                    with metrics.span("gate"):
+                        if handle_ao3_gate(page):
+                            pages.save_state()
+                    with metrics.span("readiness"):
+                        READINESS.wait(page, current_url, selector)
                 
+                    with metrics.span("extract"):
+                        page_title = page.title()
+                        raw_content = page.locator(selector).first.inner_html()
+            
                 # Preview for the first TWO new chapters of the session
-                if new_chapters_count < 2:
-                    text_preview = BeautifulSoup(pristine_html, "html.parser").get_text().strip()
-                    print("\n" + "="*50)
-                    print(f"PREVIEW (Chapter {new_chapters_count + 1}): {page_title}")
-                    print("-" * 50)
-                    print(text_preview[:400] + "...")
-                    print("="*50)
-                    confirm = input(f"\nDoes preview {new_chapters_count + 1} look correct? (y/n): ").strip().lower()
-                    if confirm != 'y':
+                pristine_html = None
+                if preview and new_chapters_count < 2:
+                    with metrics.span("clean"):
+                        pristine_html = clean_html_content(raw_content)
+                    if not confirm_preview(new_chapters_count + 1, page_title, pristine_html):
                         print("Aborting.")
                         break
+                    if new_chapters_count == 1:
+                        store.execute("UPDATE books SET confirmed = 1 WHERE id = ?", (book_id,))
+
+                if not fetched:
+                    with metrics.span("next_link"):
+                        next_url = browser_next_url(page, current_url)
 
                 max_order += 1
-                with sqlite3.connect(DB_PATH) as conn:
-                    conn.execute(
-                        "INSERT INTO chapters (book_id, url, title, html_content, chapter_order) VALUES (?, ?, ?, ?, ?)",
-                        (book_id, current_url, page_title, pristine_html, max_order)
-                    )
-                
+                store.add(current_url, page_title, raw_content, pristine_html, max_order, next_url, metrics)
+            
                 new_chapters_count += 1
-                current_url = get_next_url(page, current_url, next_selector)
-                time.sleep(1.5) # Modest pacing
-                
+                current_url = next_url
+            
             except Exception as e:
                 print(f"Error parsing {current_url}: {e}")
                 break
-        
-        browser.close()
+    
+    finally:
+        # Stores what was already fetched, also when the crawl is interrupted
+        try:
+            store.close()
+        finally:
+            pages.close()
+            strategies.save()
+    return new_chapters_count - store.skipped - len(store.failed)
+
+def fetch_toc(toc_url, toc_selector, pages):
+    """Returns the chapter URLs a book's table of contents links to, in reading order.
+
+    `toc_selector` must match the chapter links themselves. The page is read
+    over plain HTTP unless its host is known to need the browser (or the HTTP
+    copy has no matching links), in which case it is loaded in `pages`.
+    """
+    hrefs = []
+    if get_site_backend(urlparse(toc_url).netloc) != "browser":
+        try:
+            response = polite_get(PACING, toc_url, session=http_session(), timeout=30)
+            if response.status_code == 200:
+                soup = BeautifulSoup(response.text, "html.parser")
+                hrefs = [link.get("href") for link in soup.select(toc_selector)]
+        except requests.RequestException as e:
+            print(f"  [Debug] HTTP fetch of the table of contents failed ({e}), using browser.")
+    if not any(hrefs):
+        page = pages.get()
+        goto_with_retry(page, toc_url)
+        if handle_ao3_gate(page):
+            pages.save_state()
+        READINESS.wait(page, toc_url, toc_selector, kind="toc")
+        hrefs = page.locator(toc_selector).evaluate_all("links => links.map(link => link.getAttribute('href'))")
+
+    urls, seen = [], set()
+    for href in hrefs:
+        if not href or href.startswith(("#", "javascript:")):
+            continue
+        url = with_view_adult(urljoin(toc_url, href))
+        if canonical_url(url) not in seen:
+            seen.add(canonical_url(url))
+            urls.append(url)
+    return urls
+
+def renumber_chapters(book_id, chapter_urls, store):
+    """Gives the book's stored chapters their position in `chapter_urls` as chapter_order.
+
+    Chapters crawled through 'Next' links were numbered from wherever that
+    crawl started; the TOC is the authority once there is one. Stored chapters
+    it does not list keep their relative order after the listed ones.
+    """
+    positions = {canonical_url(url): position for position, url in enumerate(chapter_urls, 1)}
+    stored = connect(DB_PATH).execute(
+        "SELECT id, canonical_url, chapter_order FROM chapters WHERE book_id = ? ORDER BY chapter_order, id", (book_id,)
+    ).fetchall()
+    unlisted = iter(range(len(chapter_urls) + 1, len(chapter_urls) + len(stored) + 1))
+    changed = 0
+    for chapter_id, key, order in stored:
+        position = positions[key] if key in positions else next(unlisted)
+        if position != order:
+            store.execute("UPDATE chapters SET chapter_order = ? WHERE id = ?", (position, chapter_id))
+            changed += 1
+    if changed:
+        print(f"  [Debug] Renumbered {changed} stored chapter(s) to their TOC position.")
+        store.execute("UPDATE books SET compiled_watermark = NULL WHERE id = ?", (book_id,))
+
+def scrape_toc(book_id, toc_url, toc_selector, selector, max_new=500, browser=None, preview=True, workers=4):
+    """Fetches the chapters listed on a book's table of contents that are not stored yet.
+
+    Each chapter's chapter_order is its position in the TOC and its next_url
+    the following entry. The first missing chapters are fetched one by one,
+    which settles the host's backend and shows the previews; the rest are
+    fetched `workers` at a time: HTTP on a thread pool, or browser tabs of one
+    context navigating round-robin. PACING still spaces the requests per host,
+    so the gain is overlapping page latency, not hitting a site harder.
+    """
+    conn = connect(DB_PATH)
+    book_settings = conn.execute("SELECT block_resources, confirmed FROM books WHERE id = ?", (book_id,)).fetchone()
+    blocked_types = parse_blocked_types(book_settings[0] if book_settings else None)
+    if preview and book_settings and book_settings[1]:
+        print("  [Debug] Selectors were confirmed before, skipping previews.")
+        preview = False
+    pages = LazyPage(browser, ResourceBlocker(blocked_types), storage_state_path(toc_url))
+    store = None
+    new_chapters_count = 0
+
+    try:
+        print(f"Reading table of contents: {toc_url}")
+        try:
+            chapter_urls = fetch_toc(toc_url, toc_selector, pages)
+        except Exception as e:
+            print(f"[Error]: Could not read the table of contents {toc_url}: {e}")
+            return 0
+        if not chapter_urls:
+            print(f"[Error]: No chapter links match '{toc_selector}' on {toc_url}.")
+            return 0
+
+        store = ChapterStore(book_id)
+        # Link stored chapters to their TOC successor so next-link crawling can resume from them
+        open_ends = {row[0] for row in conn.execute(
+            "SELECT canonical_url FROM chapters WHERE book_id = ? AND next_url IS NULL", (book_id,)
+        )}
+        renumber_chapters(book_id, chapter_urls, store)
+        missing = []
+        for position, url in enumerate(chapter_urls, 1):
+            next_url = chapter_urls[position] if position < len(chapter_urls) else None
+            key = canonical_url(url)
+            if key in open_ends and next_url:
+                store.execute("UPDATE chapters SET next_url = ? WHERE canonical_url = ?", (next_url, key))
+            if not conn.execute("SELECT 1 FROM chapters WHERE canonical_url = ? AND flagged = 0", (key,)).fetchone():
+                missing.append((position, url, next_url))
+        print(f"  {len(chapter_urls)} chapters listed, {len(missing)} missing.")
+        missing = missing[:max_new]
+
+        def fetch_one(url, metrics):
+            """Fetches one chapter over HTTP or in the browser; returns (title, content_html)."""
+            host = urlparse(url).netloc
+            backend = get_site_backend(host)
+            if backend != "browser":
+                try:
+                    fetched = fetch_static(url, selector, metrics=metrics)
+                except requests.RequestException as e:
+                    if not browser_may_help(e, backend):
+                        raise
+                    print(f"  [Debug] HTTP fetch failed ({e}), trying the browser for this page.")
+                else:
+                    if fetched:
+                        if backend != "http":
+                            print(f"  [Debug] {host} works over plain HTTP, remembering that.")
+                            set_site_backend(host, "http")
+                        return fetched[:2]
+                    print(f"  [Debug] {host} needs a browser, remembering that.")
+                    set_site_backend(host, "browser")
+            metrics.backend = "browser"
+            page = pages.get()
+            goto_with_retry(page, url, metrics=metrics)
+            with metrics.span("gate"):
+                if handle_ao3_gate(page):
+                    pages.save_state()
+            with metrics.span("readiness"):
+                READINESS.wait(page, url, selector)
+            with metrics.span("extract"):
+                return page.title(), page.locator(selector).first.inner_html()
+
+        # One by one until the backend is known and the previews are approved
+        serial = 2 if preview else 1
+        while missing and new_chapters_count < serial and not store.paused:
+            position, url, next_url = missing.pop(0)
+            print(f"Fetching: {url}")
+            metrics = ChapterMetrics(book_id, url, urlparse(url).netloc)
+            try:
+                page_title, raw_content = fetch_one(url, metrics)
+            except Exception as e:
+                print(f"Error parsing {url}: {e}")
+                missing = []
+                break
+            pristine_html = None
+            if preview:
+                with metrics.span("clean"):
+                    pristine_html = clean_html_content(raw_content)
+                if not confirm_preview(new_chapters_count + 1, page_title, pristine_html):
+                    print("Aborting.")
+                    missing = []
+                    break
+                if new_chapters_count == 1:
+                    store.execute("UPDATE books SET confirmed = 1 WHERE id = ?", (book_id,))
+            store.add(url, page_title, raw_content, pristine_html, position, next_url, metrics)
+            new_chapters_count += 1
+
+        if store.paused:
+            print("Book paused. Stopping.")
+            missing = []
+        if missing and get_site_backend(urlparse(missing[0][1]).netloc) != "browser":
+            fetched, missing = fetch_toc_chapters_over_http(book_id, missing, selector, store, workers)
+            new_chapters_count += fetched
+        if missing:
+            new_chapters_count += fetch_toc_chapters_in_browser(book_id, missing, selector, store, pages, workers)
+    finally:
+        if store:
+            store.close()
+            new_chapters_count -= store.skipped + len(store.failed)
+        pages.close()
     return new_chapters_count
 
+def fetch_toc_chapters_over_http(book_id, jobs, selector, store, workers):
+    """Fetches (position, url, next_url) jobs on a thread pool and hands them to `store`.
+
+    Returns (chapters stored, jobs that only work in a browser).
+    """
+    stored, leftover = 0, []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="toc-http") as pool:
+        futures = {}
+        for job in jobs:
+            metrics = ChapterMetrics(book_id, job[1], urlparse(job[1]).netloc)
+            futures[pool.submit(fetch_static, job[1], selector, metrics=metrics)] = (job, metrics)
+        for future in as_completed(futures):
+            if store.paused:
+                print("Book paused. Stopping.")
+                pool.shutdown(cancel_futures=True)
+                return stored, []
+            job, metrics = futures[future]
+            position, url, next_url = job
+            try:
+                fetched = future.result()
+            except requests.RequestException as e:
+                if browser_may_help(e, get_site_backend(urlparse(url).netloc)):
+                    leftover.append(job)
+                else:
+                    # Throttled, missing or unreachable; the next run picks the chapter up
+                    print(f"  [Warning] Skipping {url}: {e}")
+                continue
+            if fetched is None:
+                leftover.append(job)
+                continue
+            print(f"Fetched: {url}")
+            store.add(url, fetched[0], fetched[1], None, position, next_url, metrics)
+            stored += 1
+    return stored, sorted(leftover)
+
+def fetch_toc_chapters_in_browser(book_id, jobs, selector, store, pages, workers):
+    """Loads (position, url, next_url) jobs in up to `workers` tabs and hands them to `store`.
+
+    Navigations only wait for the response to start (wait_until="commit"), so
+    while one tab is being read the others keep loading. Tabs are read in the
+    order they were sent off. Returns the number of chapters stored.
+    """
+    jobs = deque(jobs)
+    free = [pages.get()] + [pages.new_page() for _ in range(min(workers, len(jobs)) - 1)]
+    loading = deque()
+    stored = 0
+    while jobs or loading:
+        if store.paused:
+            print("Book paused. Stopping.")
+            break
+        while free and jobs:
+            page = free.pop()
+            position, url, next_url = job = jobs.popleft()
+            metrics = ChapterMetrics(book_id, url, urlparse(url).netloc)
+            metrics.backend = "browser"
+            metrics.add("pacing", PACING.wait(url))
+            start = time.monotonic()
+            try:
+                response = page.goto(url, wait_until="commit", timeout=60000)
+            except Exception as e:
+                PACING.record(url, None, time.monotonic() - start)
+                print(f"  [Warning] Skipping {url}: {e}")
+                free.append(page)
+                continue
+            status = response.status if response else 200
+            headers = response.headers if response else {}
+            metrics.add("navigation", time.monotonic() - start)
+            PACING.record(url, status, time.monotonic() - start, headers.get("retry-after"))
+            if status in THROTTLE_STATUSES:
+                print(f"  [Warning] Skipping {url}: answered {status}")
+                free.append(page)
+                continue
+            loading.append((page, job, metrics))
+        if not loading:
+            continue
+
+        page, (position, url, next_url), metrics = loading.popleft()
+        try:
+            with metrics.span("gate"):
+                page.wait_for_load_state("domcontentloaded", timeout=60000)
+                if handle_ao3_gate(page):
+                    pages.save_state()
+            with metrics.span("readiness"):
+                READINESS.wait(page, url, selector)
+            with metrics.span("extract"):
+                page_title = page.title()
+                raw_content = page.locator(selector).first.inner_html()
+        except Exception as e:
+            print(f"Error parsing {url}: {e}")
+        else:
+            print(f"Fetched: {url}")
+            store.add(url, page_title, raw_content, None, position, next_url, metrics)
+            stored += 1
+        free.append(page)
+    return stored
+
+def get_resume_point(book_id):
+    """Returns (url, selector, next_selector, title) to continue a stored book from.
+
+    Follows the stored next_url links past the last chapter, so the URL is the
+    first chapter not in the database whenever its link is already known. A
+    book with flagged chapters resumes from the first of them instead, so they
+    are fetched again (stored chapters after them are skipped over).
+    """
+    with connect(DB_PATH) as conn:
+        flagged = conn.execute(
+            "SELECT chapters.url, books.selector, books.next_selector, books.title "
+            "FROM chapters JOIN books ON chapters.book_id = books.id "
+            "WHERE book_id = ? AND flagged = 1 ORDER BY chapter_order LIMIT 1",
+            (book_id,)
+        ).fetchone()
+        if flagged:
+            return flagged
+        res = conn.execute(
+            "SELECT chapters.url, books.selector, books.next_selector, books.title, chapters.next_url "
+            "FROM chapters JOIN books ON chapters.book_id = books.id "
+            "WHERE book_id = ? ORDER BY chapter_order DESC LIMIT 1", 
+            (book_id,)
+        ).fetchone()
+        if not res:
+            # Book exists but no chapters yet
+            return conn.execute("SELECT start_url, selector, next_selector, title FROM books WHERE id = ?", (book_id,)).fetchone()
+
+        url, selector, next_selector, title, next_url = res
+        seen = {canonical_url(url)}
+        while next_url and canonical_url(next_url) not in seen:
+            seen.add(canonical_url(next_url))
+            url = next_url
+            stored = conn.execute(
+                "SELECT next_url FROM chapters WHERE canonical_url = ? AND flagged = 0", (canonical_url(url),)
+            ).fetchone()
+            if not stored:
+                break  # First unfetched chapter
+            next_url = stored[0]
+    return url, selector, next_selector, title
+
+def crawl_library(max_new=500, workers=4, per_host=1, book_ids=None, limits=None):
+    """Refreshes every stored book (or just `book_ids`) concurrently.
+
+    Each worker thread owns one Firefox and gives every book its own context.
+    At most `per_host` books from the same site are crawled at the same time.
+    `limits` maps book ids to their own chapter limit instead of `max_new`.
+    Returns {book_id: (title, new_chapter_count, crawl_seconds)}.
+    """
+    if book_ids is None:
+        with connect(DB_PATH) as conn:
+            book_ids = [row[0] for row in conn.execute("SELECT id FROM books ORDER BY id")]
+    limits = limits or {}
+
+    pending = [(book_id, *get_resume_point(book_id)) for book_id in book_ids]
+    active_hosts = {}
+    results = {}
+    slots = threading.Condition()
+
+    def claim():
+        """Hands out the next book whose host still has a free slot."""
+        with slots:
+            while pending:
+                for idx, job in enumerate(pending):
+                    host = urlparse(job[1]).netloc
+                    if active_hosts.get(host, 0) < per_host:
+                        active_hosts[host] = active_hosts.get(host, 0) + 1
+                        return pending.pop(idx), host
+                slots.wait()
+        return None, None
+
+    def release(host):
+        with slots:
+            active_hosts[host] -= 1
+            slots.notify_all()
+
+    def worker():
+        with sync_playwright() as p:
+            browser = None
+
+            def get_browser():
+                # Launched lazily so workers that only meet static sites never start Firefox
+                nonlocal browser
+                if browser is None:
+                    browser = launch_browser(p)
+                return browser
+
+            try:
+                while True:
+                    job, host = claim()
+                    if job is None:
+                        break
+                    book_id, start_url, selector, next_selector, title = job
+                    print(f"[{title}] Resuming from {start_url}")
+                    started = time.monotonic()
+                    try:
+                        count = scrape_incremental(
+                            book_id, start_url, selector, next_selector, limits.get(book_id, max_new),
+                            browser=get_browser, preview=False
+                        )
+                    except Exception as e:
+                        print(f"[Error]: Crawl of '{title}' failed: {e}")
+                        count = 0
+                    finally:
+                        release(host)
+                    results[book_id] = (title, count, time.monotonic() - started)
+                    print(f"[{title}] Done: {count} new chapter(s).")
+            finally:
+                if browser:
+                    disconnect(browser)
+                close_all()
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(max(1, min(workers, len(pending))))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    READINESS.report()
+    return results
+
+def chapter_hash(title, html_content):
+    """Fingerprints a stored chapter so the EPUB builder can tell when it changed."""
+    data = html_content if isinstance(html_content, bytes) else (html_content or "").encode("utf-8")
+    return hashlib.sha1((title or "").encode("utf-8") + b"\0" + data).hexdigest()
+
 def compile_epub(book_id, book_title):
-    """Generates an EPUB from stored chapters."""
+    """Generates an EPUB from stored chapters.
+
+    epub_chapters remembers which chapter (id and content hash) sits at which
+    position of the last EPUB built. When those are unchanged and only new
+    chapters follow, the new ones are appended to the existing file instead of
+    rebuilding the whole book. Chapter bodies are streamed from the cursor into
+    the archive one at a time, so memory stays flat however long the book is.
+    """
     print(f"Compiling EPUB for '{book_title}'...")
-    epub_filename = os.path.join(BASE_DIR, f"{book_title.replace(' ', '_')}.epub")
-    
-    book = epub.EpubBook()
-    book.set_title(book_title)
-    book.set_language("en")
-    book.add_author("Crawler Pipeline")
-
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.execute(
-            "SELECT title, html_content, chapter_order FROM chapters WHERE book_id = ? ORDER BY chapter_order ASC",
-            (book_id,)
-        )
-        rows = cursor.fetchall()
+    epub_filename = epub_path_for(book_title)
+    identifier = f"crawler-book-{book_id}"
 
-    if not rows:
+    conn = connect(DB_PATH)
+    chapters_query = (
+        "SELECT id, title, html_content, chapter_order FROM chapters WHERE book_id = ? AND flagged = 0 "
+        "AND duplicate_of IS NULL ORDER BY chapter_order ASC"
+    )
+
+    # First pass keeps only table-of-contents metadata; bodies are streamed again while writing
+    entries = [
+        (chapter_id, chapter_hash(title, html_content), f"chap_{chapter_id}.xhtml", title)
+        for chapter_id, title, html_content, _ in conn.execute(chapters_query, (book_id,))
+    ]
+
+    if not entries:
         print("No chapters found to compile.")
         return None
 
-    chapters = []
-    for title, html_content, order in rows:
-        filename = f"chap_{order}.xhtml"
-        chapter = epub.EpubHtml(title=title, file_name=filename, lang="en")
-        chapter.content = f"<h1>{title}</h1>{html_content}"
-        book.add_item(chapter)
-        chapters.append(chapter)
-
-    book.toc = tuple(chapters)
-    book.spine = ["nav"] + chapters
-    book.add_item(epub.EpubNcx())
-    book.add_item(epub.EpubNav())
-    
-    if os.path.exists(epub_filename):
-        os.remove(epub_filename)
-    
-    epub.write_epub(epub_filename, book)
+    built = conn.execute(
+        "SELECT chapter_id, content_hash, file_name, title FROM epub_chapters WHERE book_id = ? ORDER BY position",
+        (book_id,)
+    ).fetchall()
+
+    writer = None
+    # File names are compared too: EPUBs from before they were keyed by chapter id get rebuilt
+    if built and os.path.exists(epub_filename) and [b[:3] for b in built] == [e[:3] for e in entries[:len(built)]]:
+        if len(built) == len(entries):
+            print(f"EPUB already up to date: {epub_filename}")
+            set_compiled_watermark(book_id, max(e[0] for e in entries))
+            return epub_filename
+        try:
+            writer = EpubWriter.append(epub_filename, book_title, identifier, "Crawler Pipeline", [b[2:] for b in built])
+            pending = entries[len(built):]
+            print(f"Appending {len(pending)} new chapter(s) to the existing EPUB...")
+        except NotAppendable as e:
+            print(f"  [Debug] Rebuilding instead of appending: {e}")
+
+    if writer is None:
+        built = []
+        pending = entries
+        writer = EpubWriter(epub_filename, book_title, identifier, "Crawler Pipeline")
+
+    try:
+        with writer:
+            rows = islice(conn.execute(chapters_query, (book_id,)), len(built), None)
+            for (chapter_id, _, file_name, _), (row_id, title, html_content, _) in zip(pending, rows):
+                if row_id != chapter_id:
+                    raise RuntimeError("chapters changed while compiling")
+                writer.add_chapter(file_name, title, f"<h1>{title}</h1>{decompress_html(DB_PATH, html_content)}")
+    except Exception as e:
+        if not built:
+            raise
+        # The old file is left as it was, but what failed may recur; build it from scratch
+        print(f"  [Warning] Appending failed ({e}), rebuilding the EPUB...")
+        conn.execute("DELETE FROM epub_chapters WHERE book_id = ?", (book_id,))
+        conn.commit()
+        return compile_epub(book_id, book_title)
+
+    with conn:
+        if not built:
+            conn.execute("DELETE FROM epub_chapters WHERE book_id = ?", (book_id,))
+        conn.executemany(
+            "INSERT INTO epub_chapters (book_id, position, chapter_id, content_hash, file_name, title) VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (book_id, position, chapter_id, content_hash, file_name, title)
+                for position, (chapter_id, content_hash, file_name, title) in enumerate(pending, len(built))
+            ]
+        )
+    set_compiled_watermark(book_id, max(e[0] for e in entries))
     print(f"EPUB created: {epub_filename}")
     return epub_filename
 
+def set_compiled_watermark(book_id, chapter_id):
+    with connect(DB_PATH) as conn:
+        conn.execute("UPDATE books SET compiled_watermark = ? WHERE id = ?", (chapter_id, book_id))
+
+def epub_path_for(book_title):
+    return os.path.join(BASE_DIR, f"{book_title.replace(' ', '_')}.epub")
+
+def changed_books():
+    """Returns [(book_id, title)] of books with chapters newer than their last compiled EPUB, or no EPUB."""
+    with connect(DB_PATH) as conn:
+        rows = conn.execute(
+            "SELECT id, title, compiled_watermark, "
+            "(SELECT MAX(id) FROM chapters WHERE chapters.book_id = books.id AND flagged = 0 AND duplicate_of IS NULL) "
+            "FROM books ORDER BY id"
+        ).fetchall()
+    return [
+        (book_id, title) for book_id, title, watermark, newest in rows
+        if newest is not None and (watermark is None or newest > watermark or not os.path.exists(epub_path_for(title)))
+    ]
+
+def _compile_in_worker(book_id, book_title):
+    """compile_epub for a pool worker: returns (epub_path, seconds) and closes its connection."""
+    started = time.monotonic()
+    try:
+        return compile_epub(book_id, book_title), time.monotonic() - started
+    finally:
+        close_all()
+
+def compile_books(books, jobs=None):
+    """Builds the EPUBs of [(book_id, title)] in parallel worker processes.
+
+    Compiling is CPU-bound (XHTML rendering, deflate), so each book gets its own
+    process, up to `jobs` (default: one per core) at a time. Returns
+    {book_id: (title, epub_path or None, seconds)}.
+    """
+    results = {}
+    if len(books) <= 1 or jobs == 1:
+        for book_id, title in books:
+            results[book_id] = (title, *_compile_in_worker(book_id, title))
+        return results
+
+    jobs = min(jobs or os.cpu_count() or 1, len(books))
+    print(f"Compiling {len(books)} EPUB(s) on {jobs} worker process(es)...")
+    # Fresh interpreters: forked children would inherit this process's SQLite connections
+    with ProcessPoolExecutor(jobs, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {pool.submit(_compile_in_worker, book_id, title): (book_id, title) for book_id, title in books}
+        for future in as_completed(futures):
+            book_id, title = futures[future]
+            try:
+                results[book_id] = (title, *future.result())
+            except Exception as e:
+                print(f"[Error]: Compiling '{title}' failed: {e}")
+                results[book_id] = (title, None, 0.0)
+    return results
+
+def update_library(max_new=500, workers=4, per_host=1, book_ids=None, limits=None):
+    """Crawls the library, then rebuilds and syncs the EPUBs that changed.
+
+    Prints a run summary and returns it as a list of per-book dicts with the
+    new chapter count and the seconds spent crawling, compiling and syncing.
+    """
+    print("=== Refreshing all books ===")
+    start = time.monotonic()
+    results = crawl_library(max_new, workers, per_host, book_ids, limits)
+
+    compiled = compile_books([(book_id, title) for book_id, (title, count, _) in results.items() if count > 0])
+    summary = []
+    changed = []
+    for book_id, (title, count, crawl_seconds) in results.items():
+        stages = {"crawl": crawl_seconds, "compile": 0.0, "sync": 0.0}
+        if book_id in compiled:
+            _, epub_path, stages["compile"] = compiled[book_id]
+            if epub_path:
+                changed.append((title, epub_path))
+        summary.append({"book_id": book_id, "title": title, "new_chapters": count, "seconds": stages})
+
+    # One Calibre session for every changed book (and syncs queued while Calibre was open)
+    started = time.monotonic()
+    synced = sync_epubs(DB_PATH, changed, id_table="books")
+    sync_seconds = time.monotonic() - started
+    for entry in summary:
+        if entry["title"] in synced:
+            entry["seconds"]["sync"] = sync_seconds / len(synced)
+
+    elapsed = time.monotonic() - start
+    print(f"\nLibrary refresh finished in {elapsed:.0f}s:")
+    print(f"  {'Book':<40} {'New':>5} {'Crawl':>8} {'Compile':>8} {'Sync':>8}")
+    for entry in sorted(summary, key=lambda e: e["title"]):
+        stages = entry["seconds"]
+        print(
+            f"  {entry['title'][:40]:<40} {entry['new_chapters']:>5} "
+            f"{stages['crawl']:>7.1f}s {stages['compile']:>7.1f}s {stages['sync']:>7.1f}s"
+        )
+    totals = {stage: sum(e["seconds"][stage] for e in summary) for stage in ("crawl", "compile", "sync")}
+    print(
+        f"  {'Total':<40} {sum(e['new_chapters'] for e in summary):>5} "
+        f"{totals['crawl']:>7.1f}s {totals['compile']:>7.1f}s {totals['sync']:>7.1f}s"
+    )
+    return summary
+
+def check_chapter(url, selector, stored_hash, etag, last_modified):
+    """Re-fetches one stored chapter over HTTP, conditionally when validators are known.
+
+    Returns (status, title, pristine_html, etag, last_modified) where status is
+    "not-modified" (304), "same" (content hash unchanged), "changed" or "failed".
+    """
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    try:
+        response = polite_get(PACING, url, session=http_session(), headers=headers, timeout=30)
+    except requests.RequestException as e:
+        print(f"  [Warning] {url}: {e}")
+        return "failed", None, None, etag, last_modified
+    if response.status_code == 304:
+        return "not-modified", None, None, etag, last_modified
+    if response.status_code != 200:
+        print(f"  [Warning] {url} answered {response.status_code}")
+        return "failed", None, None, etag, last_modified
+
+    etag = response.headers.get("ETag")
+    last_modified = response.headers.get("Last-Modified")
+    soup = BeautifulSoup(response.text, "html.parser")
+    content = soup.select_one(selector)
+    if content is None or not content.get_text().strip():
+        print(f"  [Warning] {url}: content selector matched nothing")
+        return "failed", None, None, etag, last_modified
+    pristine_html = clean_html_content(content.decode_contents())
+    title = soup.title.get_text().strip() if soup.title else ""
+    status = "same" if content_hash(pristine_html) == stored_hash else "changed"
+    return status, title, pristine_html, etag, last_modified
+
+def revalidate_book(book_id, sample=None, workers=4):
+    """Checks a book's stored chapters for revisions without the browser.
+
+    Chapters are re-requested over HTTP, `workers` at a time (PACING still
+    spaces requests per host), with If-None-Match/If-Modified-Since once the
+    server's validators are known. A chapter whose cleaned text hash differs
+    is updated in place and its old version kept in chapter_revisions.
+    `sample` limits the pass to the chapters checked longest ago. Returns a
+    Counter of statuses (see check_chapter) for the book.
+    """
+    conn = connect(DB_PATH)
+    selector, book_title = conn.execute("SELECT selector, title FROM books WHERE id = ?", (book_id,)).fetchone()
+    rows = conn.execute(
+        "SELECT id, url, title, html_content, content_hash, etag, last_modified FROM chapters WHERE book_id = ? "
+        "AND duplicate_of IS NULL ORDER BY revalidated_at IS NOT NULL, revalidated_at, chapter_order" + (" LIMIT ?" if sample else ""),
+        (book_id, sample) if sample else (book_id,)
+    ).fetchall()
+    counts = Counter()
+    if not rows:
+        return counts
+    if get_site_backend(urlparse(rows[0][1]).netloc) == "browser":
+        print(f"[{book_title}] Needs the browser; revalidation only works for sites readable over HTTP.")
+        return counts
+    placeholders = [row[0] for row in conn.execute("SELECT simhash FROM placeholder_fingerprints")]
+
+    print(f"[{book_title}] Revalidating {len(rows)} chapter(s)...")
+    writer = BatchWriter(conn)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="revalidate") as pool:
+        futures = {}
+        for chapter_id, url, old_title, old_html, stored_hash, etag, last_modified in rows:
+            # Chapters stored before content hashes existed are hashed from what is stored
+            stored_hash = stored_hash or content_hash(decompress_html(DB_PATH, old_html))
+            future = pool.submit(check_chapter, url, selector, stored_hash, etag, last_modified)
+            futures[future] = (chapter_id, url, old_title, old_html, stored_hash)
+        for future in as_completed(futures):
+            chapter_id, url, old_title, old_html, stored_hash = futures[future]
+            status, title, pristine_html, etag, last_modified = future.result()
+            counts[status] += 1
+            if status == "failed":
+                continue
+            writer.add(
+                "UPDATE chapters SET etag = ?, last_modified = ?, revalidated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                (etag, last_modified, chapter_id)
+            )
+            if status != "changed":
+                continue
+            print(f"  Changed: {url}")
+            fingerprint = simhash(html_to_text(pristine_html))
+            title = title or old_title
+            writer.add(
+                "INSERT INTO chapter_revisions (chapter_id, title, html_content, content_hash) VALUES (?, ?, ?, ?)",
+                (chapter_id, old_title, old_html, stored_hash)
+            )
+            writer.add(
+                "UPDATE chapters SET title = ?, html_content = ?, content_hash = ?, simhash = ?, flagged = ? WHERE id = ?",
+                (
+                    title, compress_html(DB_PATH, pristine_html, f"book:{book_id}"), content_hash(pristine_html),
+                    fingerprint, 1 if near_placeholder(fingerprint, placeholders) else 0, chapter_id,
+                )
+            )
+            writer.add(*index_statement("chapters", title, pristine_html, url))
+    if counts["changed"]:
+        # The EPUB no longer matches; the next compile rebuilds the changed chapters
+        writer.add("UPDATE books SET compiled_watermark = NULL WHERE id = ?", (book_id,))
+    writer.flush()
+    return counts
+
+def revalidate_library(book_ids=None, sample=None, workers=4, compile_changed=False):
+    """Revalidates every book (or `book_ids`) and prints what changed; optionally rebuilds and syncs their EPUBs."""
+    with connect(DB_PATH) as conn:
+        books = conn.execute("SELECT id, title FROM books ORDER BY id").fetchall()
+    if book_ids:
+        books = [book for book in books if book[0] in book_ids]
+
+    summary, changed = [], []
+    for book_id, title in books:
+        started = time.monotonic()
+        counts = revalidate_book(book_id, sample, workers)
+        summary.append((title, counts, time.monotonic() - started))
+        if counts["changed"]:
+            changed.append((book_id, title))
+
+    print(f"\n{'Book':<40} {'304':>5} {'Same':>5} {'Changed':>8} {'Failed':>7} {'Time':>7}")
+    for title, counts, seconds in summary:
+        print(
+            f"{title[:40]:<40} {counts['not-modified']:>5} {counts['same']:>5} {counts['changed']:>8} "
+            f"{counts['failed']:>7} {seconds:>6.1f}s"
+        )
+    if compile_changed and changed:
+        compiled = compile_books(changed)
+        sync_epubs(DB_PATH, [(title, path) for title, path, _ in compiled.values() if path], id_table="books")
+    return summary
+
+def load_batch_config(path):
+    """Registers the books listed in a batch config file and returns its settings.
+
+    The file is JSON: {"workers": 4, "per_host": 1, "max_new": 500, "books": [...]},
+    where each book has "title", "start_url" and "selector" and may set
+    "next_selector", "block_resources", "max_new", and "toc_url" with
+    "toc_selector" (start_url then defaults to toc_url). Books are matched by
+    title; listing one counts as confirming its selectors. Returns (book_ids, options).
+    """
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+
+    book_ids = []
+    with connect(DB_PATH) as conn:
+        for book in config.get("books", []):
+            if book.get("toc_url") and not book.get("start_url"):
+                book = dict(book, start_url=book["toc_url"])
+            missing = [key for key in ("title", "start_url", "selector") if not book.get(key)]
+            if missing:
+                raise ValueError(f"Book entry {book!r} in {path} is missing {', '.join(missing)}")
+            conn.execute(
+                "INSERT INTO books (title, start_url, selector, next_selector, block_resources, max_new, "
+                "toc_url, toc_selector, confirmed) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1) "
+                "ON CONFLICT(title) DO UPDATE SET start_url = excluded.start_url, selector = excluded.selector, "
+                "next_selector = excluded.next_selector, block_resources = excluded.block_resources, "
+                "max_new = excluded.max_new, toc_url = excluded.toc_url, toc_selector = excluded.toc_selector, "
+                "confirmed = 1",
+                (
+                    book["title"], book["start_url"], book["selector"], book.get("next_selector"),
+                    book.get("block_resources"), book.get("max_new"), book.get("toc_url"), book.get("toc_selector"),
+                )
+            )
+            book_ids.append(conn.execute("SELECT id FROM books WHERE title = ?", (book["title"],)).fetchone()[0])
+    options = {key: config[key] for key in ("workers", "per_host", "max_new") if key in config}
+    return book_ids, options
+
+def run_batch(config_path=None, every=None, max_new=500, workers=4, per_host=1):
+    """Unattended crawl of the confirmed books (or those in `config_path`), optionally every `every` minutes.
+
+    Books whose previews were never approved are skipped, since nobody is there
+    to look at them. Each run's summary is appended to crawl_runs.jsonl.
+    """
+    while True:
+        started_at = time.strftime("%Y-%m-%dT%H:%M:%S")
+        run_start = time.monotonic()
+        options = {"max_new": max_new, "workers": workers, "per_host": per_host}
+        if config_path:
+            book_ids, file_options = load_batch_config(config_path)
+            options.update(file_options)
+        else:
+            with connect(DB_PATH) as conn:
+                book_ids = [row[0] for row in conn.execute("SELECT id FROM books WHERE confirmed = 1 ORDER BY id")]
+                skipped = [row[0] for row in conn.execute("SELECT title FROM books WHERE NOT confirmed")]
+            if skipped:
+                print(f"[Warning] Skipping {len(skipped)} unconfirmed book(s): {', '.join(skipped)}")
+                print("  Run them once interactively, or list them in a --config file.")
+
+        with connect(DB_PATH) as conn:
+            limits = {
+                book_id: limit for book_id, limit in conn.execute("SELECT id, max_new FROM books WHERE max_new IS NOT NULL")
+            }
+
+        summary = update_library(options["max_new"], options["workers"], options["per_host"], book_ids, limits)
+        with open(os.path.join(BASE_DIR, "crawl_runs.jsonl"), "a", encoding="utf-8") as f:
+            f.write(json.dumps({"started_at": started_at, "books": summary}) + "\n")
+
+        if not every:
+            return
+        pause = max(0, every * 60 - (time.monotonic() - run_start))
+        print(f"Next run in {pause / 60:.0f} minute(s).")
+        time.sleep(pause)
+
 def main():
+    parser = argparse.ArgumentParser(description="Multi-chapter novel scraper. Runs interactively without a command.")
+    commands = parser.add_subparsers(dest="command")
+    update_all = commands.add_parser("update-all", help="Fetch new chapters for every stored book concurrently")
+    update_all.add_argument("--workers", type=int, default=4, help="Browser contexts crawling at once (default 4)")
+    update_all.add_argument("--per-host", type=int, default=1, help="Books from the same site crawled at once (default 1)")
+    update_all.add_argument("--max-new", type=int, default=500, help="New chapters per book (default 500)")
+    batch = commands.add_parser("batch", help="Unattended run over confirmed books, optionally on a schedule")
+    batch.add_argument("--config", help="JSON file listing books and limits (default: confirmed books in the DB)")
+    batch.add_argument("--every", type=float, metavar="MINUTES", help="Keep running, starting a new pass every MINUTES")
+    batch.add_argument("--workers", type=int, default=4, help="Browser contexts crawling at once (default 4)")
+    batch.add_argument("--per-host", type=int, default=1, help="Books from the same site crawled at once (default 1)")
+    batch.add_argument("--max-new", type=int, default=500, help="New chapters per book without its own limit (default 500)")
+    compile_cmd = commands.add_parser("compile", help="Build EPUBs in parallel (default: books changed since their last build)")
+    compile_cmd.add_argument("book_ids", nargs="*", type=int, help="Books to compile instead of the changed ones")
+    compile_cmd.add_argument("--jobs", type=int, help="Worker processes (default: one per CPU core)")
+    compile_cmd.add_argument("--sync", action="store_true", help="Push the built EPUBs to Calibre afterwards")
+    report = commands.add_parser("report", help="Print per-stage crawl timings per book and per domain")
+    report.add_argument("--since", type=float, metavar="DAYS", help="Only chapters fetched in the last DAYS days")
+    report.add_argument("--book", type=int, metavar="ID", help="Only this book id")
+    revalidate = commands.add_parser("revalidate", help="Look for revised chapters over HTTP and update them")
+    revalidate.add_argument("book_ids", nargs="*", type=int, help="Books to check (default: all)")
+    revalidate.add_argument("--sample", type=int, metavar="N", help="Only the N chapters per book checked longest ago")
+    revalidate.add_argument("--workers", type=int, default=4, help="Requests in flight at once (default 4)")
+    revalidate.add_argument("--compile", action="store_true", help="Rebuild and sync the EPUBs of changed books")
+    unpause = commands.add_parser("unpause", help="Crawl books again that were paused for repeated placeholder pages")
+    unpause.add_argument("book_ids", nargs="+", type=int, help="Books to resume")
+    args = parser.parse_args()
+
     init_db()
+    if args.command == "report":
+        print_report(DB_PATH, args.since, args.book)
+        return
+    if args.command == "revalidate":
+        revalidate_library(args.book_ids, args.sample, args.workers, args.compile)
+        return
+    if args.command == "unpause":
+        with connect(DB_PATH) as conn:
+            conn.executemany("UPDATE books SET paused = NULL WHERE id = ?", [(book_id,) for book_id in args.book_ids])
+        print(f"Unpaused {len(args.book_ids)} book(s).")
+        return
+    if args.command == "compile":
+        if args.book_ids:
+            with connect(DB_PATH) as conn:
+                books = [
+                    (book_id, row[0]) for book_id in args.book_ids
+                    for row in conn.execute("SELECT title FROM books WHERE id = ?", (book_id,))
+                ]
+        else:
+            books = changed_books()
+        if not books:
+            print("Every EPUB is up to date.")
+            return
+        started = time.monotonic()
+        compiled = compile_books(books, args.jobs)
+        print(f"\nCompiled {len(compiled)} book(s) in {time.monotonic() - started:.1f}s:")
+        for title, epub_path, seconds in sorted(compiled.values()):
+            print(f"  {title}: {seconds:.1f}s" + ("" if epub_path else " (failed)"))
+        if args.sync:
+            sync_epubs(DB_PATH, [(title, path) for title, path, _ in compiled.values() if path], id_table="books")
+        return
+    if args.command == "update-all":
+        update_library(args.max_new, args.workers, args.per_host)
+        return
+    if args.command == "batch":
+        run_batch(args.config, args.every, args.max_new, args.workers, args.per_host)
+        return
+
     print("=== Multi-Chapter Novel Scraper & Digest ===")
     
     # List existing books
-    with sqlite3.connect(DB_PATH) as conn:
+    with connect(DB_PATH) as conn:
         cursor = conn.execute("SELECT id, title FROM books")
         existing_books = cursor.fetchall()
 
@@ -411,29 +1854,22 @@ def main():
         start_url = input("Enter the STARTING chapter URL: ").strip()
         selector = input("Enter the CSS selector for the content block: ").strip()
         next_selector = input("Enter CSS selector for 'Next' link (optional, press Enter for auto): ").strip()
+        toc_url = input("Enter the table of contents URL (optional, press Enter to follow 'Next' links): ").strip()
+        toc_selector = input("Enter the CSS selector for its chapter links: ").strip() if toc_url else ""
         
-        with sqlite3.connect(DB_PATH) as conn:
+        with connect(DB_PATH) as conn:
             cursor = conn.execute(
-                "INSERT INTO books (title, start_url, selector, next_selector) VALUES (?, ?, ?, ?)",
-                (book_title, start_url, selector, next_selector)
+                "INSERT INTO books (title, start_url, selector, next_selector, toc_url, toc_selector) VALUES (?, ?, ?, ?, ?, ?)",
+                (book_title, start_url, selector, next_selector, toc_url or None, toc_selector or None)
             )
             book_id = cursor.lastrowid
     else:
         # For existing books, find the last URL to resume
-        with sqlite3.connect(DB_PATH) as conn:
-            res = conn.execute(
-                "SELECT chapters.url, books.selector, books.next_selector, books.title "
-                "FROM chapters JOIN books ON chapters.book_id = books.id "
-                "WHERE book_id = ? ORDER BY chapter_order DESC LIMIT 1", 
-                (book_id,)
-            ).fetchone()
-            if res:
-                last_url, selector, next_selector, book_title = res
-                start_url = last_url
-            else:
-                # Book exists but no chapters yet
-                res = conn.execute("SELECT start_url, selector, next_selector, title FROM books WHERE id = ?", (book_id,)).fetchone()
-                start_url, selector, next_selector, book_title = res
+        start_url, selector, next_selector, book_title = get_resume_point(book_id)
+        with connect(DB_PATH) as conn:
+            paused = conn.execute("SELECT paused FROM books WHERE id = ?", (book_id,)).fetchone()[0]
+            if paused and input(f"\n'{book_title}' is paused: {paused}. Crawl it again? (y/n): ").strip().lower() == 'y':
+                conn.execute("UPDATE books SET paused = NULL WHERE id = ?", (book_id,))
         
         print(f"\nCurrent Selectors for '{book_title}':")
         print(f"  Content: {selector}")
@@ -447,14 +1883,35 @@ def main():
             new_next = input(f"Enter new Next selector (Enter to keep '{next_selector}'): ").strip()
             if new_next: next_selector = new_next
             
-            with sqlite3.connect(DB_PATH) as conn:
-                conn.execute("UPDATE books SET selector = ?, next_selector = ? WHERE id = ?", (selector, next_selector, book_id))
+            with connect(DB_PATH) as conn:
+                # New selectors need a fresh look at the previews
+                conn.execute(
+                    "UPDATE books SET selector = ?, next_selector = ?, confirmed = 0 WHERE id = ?",
+                    (selector, next_selector, book_id)
+                )
+                current_block = conn.execute("SELECT block_resources FROM books WHERE id = ?", (book_id,)).fetchone()[0]
+                new_block = input(
+                    f"Resource types to block, comma-separated or 'none' (Enter to keep '{current_block or ','.join(DEFAULT_BLOCKED_TYPES)}'): "
+                ).strip()
+                if new_block:
+                    conn.execute("UPDATE books SET block_resources = ? WHERE id = ?", (new_block, book_id))
+                toc_url, toc_selector = conn.execute("SELECT toc_url, toc_selector FROM books WHERE id = ?", (book_id,)).fetchone()
+                new_toc = input(f"Table of contents URL, 'none' to follow 'Next' links (Enter to keep '{toc_url or 'none'}'): ").strip()
+                if new_toc.lower() == "none":
+                    conn.execute("UPDATE books SET toc_url = NULL, toc_selector = NULL WHERE id = ?", (book_id,))
+                elif new_toc or toc_url:
+                    new_toc_selector = input(f"Chapter link selector (Enter to keep '{toc_selector}'): ").strip()
+                    conn.execute(
+                        "UPDATE books SET toc_url = ?, toc_selector = ? WHERE id = ?",
+                        (new_toc or toc_url, new_toc_selector or toc_selector, book_id)
+                    )
                 print("Selectors updated.")
 
     max_new = input("How many NEW chapters to fetch? (Default 10): ").strip()
     max_new = int(max_new) if max_new.isdigit() else 10
     
     new_count = scrape_incremental(book_id, start_url, selector, next_selector, max_new)
+    READINESS.report()
     
     if new_count > 0:
         epub_path = compile_epub(book_id, book_title)
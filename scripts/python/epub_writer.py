@@ -0,0 +1,206 @@
+import os
+import shutil
+import zipfile
+from datetime import datetime, timezone
+from html import escape
+
+import lxml.html
+from lxml import etree
+
+# Package documents are written after every chapter, so an existing archive can
+# be extended by cutting them off, appending chapters and writing them again.
+OPF_PATH = "EPUB/content.opf"
+NAV_PATH = "EPUB/nav.xhtml"
+NCX_PATH = "EPUB/toc.ncx"
+PACKAGE_FILES = (NAV_PATH, NCX_PATH, OPF_PATH)
+
+CONTAINER_XML = """<?xml version="1.0" encoding="utf-8"?>
+<container xmlns="urn:oasis:names:tc:opendocument:xmlns:container" version="1.0">
+  <rootfiles>
+    <rootfile media-type="application/oebps-package+xml" full-path="EPUB/content.opf"/>
+  </rootfiles>
+</container>
+"""
+
+CHAPTER_XHTML = """<?xml version="1.0" encoding="utf-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" lang="{lang}" xml:lang="{lang}">
+<head><title>{title}</title></head>
+<body>{body}</body>
+</html>
+"""
+
+
+class NotAppendable(Exception):
+    """The existing file is missing or was not laid out by EpubWriter."""
+
+
+def render_xhtml(title, html, lang="en"):
+    """Turns an HTML fragment or document into a standalone XHTML chapter file."""
+    if html and html.strip():
+        body = lxml.html.document_fromstring(html).find("body")
+    else:
+        body = None
+    parts = []
+    if body is not None:
+        if body.text:
+            parts.append(escape(body.text))
+        for child in body:
+            parts.append(etree.tostring(child, method="xml", encoding="unicode"))
+    return CHAPTER_XHTML.format(lang=lang, title=escape(title or ""), body="".join(parts))
+
+
+class EpubWriter:
+    """Writes an EPUB 3 file one chapter at a time.
+
+    Each add_chapter() call goes straight into the zip, so only the table of
+    contents is kept in memory. The navigation document, NCX and OPF come last
+    in the archive, which lets append() reopen a finished book and add chapters
+    without rewriting the existing ones.
+    """
+
+    def __init__(self, path, title, identifier, author, lang="en"):
+        self.path = path
+        self.title = title
+        self.identifier = identifier
+        self.author = author
+        self.lang = lang
+        self.toc = []  # (file_name, title) in spine order
+
+        tmp_path = path + ".part"
+        self.zip = zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED)
+        self.tmp_path = tmp_path
+        # The mimetype entry must be first and stored uncompressed
+        self.zip.writestr(zipfile.ZipInfo("mimetype"), "application/epub+zip", zipfile.ZIP_STORED)
+        self.zip.writestr("META-INF/container.xml", CONTAINER_XML)
+
+    @classmethod
+    def append(cls, path, title, identifier, author, existing_toc, lang="en"):
+        """Reopens a file written by EpubWriter to add more chapters.
+
+        `existing_toc` lists the (file_name, title) pairs already in the book, in
+        order. The chapters go into a copy that replaces `path` on close(), so
+        a failed append leaves the old book intact. Raises NotAppendable if the
+        archive does not have the expected layout.
+        """
+        tmp_path = path + ".part"
+        try:
+            shutil.copyfile(path, tmp_path)
+            archive = zipfile.ZipFile(tmp_path, "a", zipfile.ZIP_DEFLATED)
+        except (OSError, zipfile.BadZipFile) as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise NotAppendable(str(e))
+
+        infos = archive.infolist()
+        tail = [info for info in infos if info.filename in PACKAGE_FILES]
+        cut = min((info.header_offset for info in tail), default=None)
+        names = {info.filename for info in infos}
+        if (
+            len(tail) != len(PACKAGE_FILES)
+            or any(info.header_offset > cut for info in infos if info.filename not in PACKAGE_FILES)
+            or any("EPUB/" + file_name not in names for file_name, _ in existing_toc)
+        ):
+            archive.close()
+            os.remove(tmp_path)
+            raise NotAppendable(f"{path} was not written by EpubWriter")
+        # zipfile has no way to remove entries, so this relies on its internals; without them the book is rebuilt
+        if not all(hasattr(archive, name) for name in ("filelist", "NameToInfo", "start_dir", "_didModify")):
+            archive.close()
+            os.remove(tmp_path)
+            raise NotAppendable("this Python's zipfile cannot be cut back")
+
+        # Drop the package documents: new entries and the central directory go where they began
+        archive.filelist = [info for info in infos if info.header_offset < cut]
+        archive.NameToInfo = {info.filename: info for info in archive.filelist}
+        archive.start_dir = cut
+        archive.fp.seek(cut)
+        archive.fp.truncate()
+        archive._didModify = True
+
+        writer = cls.__new__(cls)
+        writer.path = path
+        writer.tmp_path = tmp_path
+        writer.title = title
+        writer.identifier = identifier
+        writer.author = author
+        writer.lang = lang
+        writer.toc = list(existing_toc)
+        writer.zip = archive
+        return writer
+
+    def add_chapter(self, file_name, title, html):
+        """Renders `html` and writes it to the archive as EPUB/<file_name>."""
+        self.zip.writestr("EPUB/" + file_name, render_xhtml(title, html, self.lang))
+        self.toc.append((file_name, title))
+
+    def close(self):
+        """Writes the navigation and package documents and finishes the file."""
+        self.zip.writestr(NAV_PATH, self._nav())
+        self.zip.writestr(NCX_PATH, self._ncx())
+        self.zip.writestr(OPF_PATH, self._opf())
+        self.zip.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        """Discards the unfinished copy; a book being appended to keeps its old contents."""
+        self.zip.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _nav(self):
+        items = "".join(
+            f'<li><a href="{escape(file_name)}">{escape(title or "")}</a></li>' for file_name, title in self.toc
+        )
+        return (
+            '<?xml version="1.0" encoding="utf-8"?>\n<!DOCTYPE html>\n'
+            f'<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" lang="{self.lang}" xml:lang="{self.lang}">'
+            f"<head><title>{escape(self.title)}</title></head><body>"
+            f'<nav epub:type="toc" id="toc" role="doc-toc"><h2>{escape(self.title)}</h2><ol>{items}</ol></nav>'
+            "</body></html>"
+        )
+
+    def _ncx(self):
+        points = "".join(
+            f'<navPoint id="np{idx}"><navLabel><text>{escape(title or "")}</text></navLabel>'
+            f'<content src="{escape(file_name)}"/></navPoint>'
+            for idx, (file_name, title) in enumerate(self.toc, 1)
+        )
+        return (
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" version="2005-1">'
+            f'<head><meta content="{escape(self.identifier)}" name="dtb:uid"/></head>'
+            f"<docTitle><text>{escape(self.title)}</text></docTitle><navMap>{points}</navMap></ncx>"
+        )
+
+    def _opf(self):
+        manifest = "".join(
+            f'<item href="{escape(file_name)}" id="c{idx}" media-type="application/xhtml+xml"/>'
+            for idx, (file_name, _) in enumerate(self.toc, 1)
+        )
+        spine = "".join(f'<itemref idref="c{idx}"/>' for idx in range(1, len(self.toc) + 1))
+        modified = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        return (
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<package xmlns="http://www.idpf.org/2007/opf" unique-identifier="id" version="3.0">'
+            '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">'
+            f'<dc:identifier id="id">{escape(self.identifier)}</dc:identifier>'
+            f"<dc:title>{escape(self.title)}</dc:title>"
+            f"<dc:language>{self.lang}</dc:language>"
+            f"<dc:creator>{escape(self.author)}</dc:creator>"
+            f'<meta property="dcterms:modified">{modified}</meta>'
+            "</metadata>"
+            '<manifest><item href="nav.xhtml" id="nav" media-type="application/xhtml+xml" properties="nav"/>'
+            f'<item href="toc.ncx" id="ncx" media-type="application/x-dtbncx+xml"/>{manifest}</manifest>'
+            f'<spine toc="ncx"><itemref idref="nav"/>{spine}</spine>'
+            "</package>"
+        )
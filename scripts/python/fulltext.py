@@ -0,0 +1,134 @@
+import argparse
+import os
+import sqlite3
+
+from cleaner import html_to_text
+from storage import connect, decompress_html
+
+KNOWLEDGE_DIR = os.path.expanduser("~/github/knowledge")
+DEFAULT_DBS = (
+    os.path.join(KNOWLEDGE_DIR, "novels_digest.db"),
+    os.path.join(KNOWLEDGE_DIR, "articles_digest.db"),
+)
+
+# Indexed tables; each gets a <table>_fts index whose rowid is the source row's id
+INDEXED_TABLES = ("chapters", "articles")
+
+# Ranked hits with their book (or "Articles"), chapter title, URL and a highlighted snippet
+SEARCH_SQL = {
+    "chapters": """
+        SELECT COALESCE(b.title, 'book ' || c.book_id), c.title, c.url,
+               snippet(chapters_fts, 1, '[', ']', ' ... ', 16), bm25(chapters_fts, 5.0, 1.0)
+        FROM chapters_fts
+        JOIN chapters c ON c.id = chapters_fts.rowid
+        LEFT JOIN books b ON b.id = c.book_id
+        WHERE chapters_fts MATCH ?
+        ORDER BY bm25(chapters_fts, 5.0, 1.0) LIMIT ?
+    """,
+    "articles": """
+        SELECT 'Articles', a.title, a.url,
+               snippet(articles_fts, 1, '[', ']', ' ... ', 16), bm25(articles_fts, 5.0, 1.0)
+        FROM articles_fts
+        JOIN articles a ON a.id = articles_fts.rowid
+        WHERE articles_fts MATCH ?
+        ORDER BY bm25(articles_fts, 5.0, 1.0) LIMIT ?
+    """,
+}
+
+
+def create_index(conn, table):
+    """Creates the FTS5 index for `table` (title and plain-text body) if missing."""
+    conn.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5("
+        "title, body, tokenize = 'porter unicode61 remove_diacritics 2')"
+    )
+
+
+def index_statement(table, title, html, url):
+    """Returns (sql, params) that (re)indexes the row of `table` with this URL.
+
+    Runs after the row's INSERT, in the same batch, so the id assigned by
+    SQLite does not have to be known in advance.
+    """
+    return (
+        f"INSERT OR REPLACE INTO {table}_fts (rowid, title, body) SELECT id, ?, ? FROM {table} WHERE url = ?",
+        (title or "", html_to_text(html), url),
+    )
+
+
+def rebuild(db_path, batch_size=200):
+    """Indexes every row of `db_path` that is not in its FTS index yet."""
+    conn = connect(db_path)
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    for table in INDEXED_TABLES:
+        if table not in tables:
+            continue
+        with conn:
+            create_index(conn, table)
+        done, last_id = 0, 0
+        while True:
+            rows = conn.execute(
+                f"SELECT id, title, html_content FROM {table} WHERE id > ? "
+                f"AND id NOT IN (SELECT rowid FROM {table}_fts) ORDER BY id LIMIT ?",
+                (last_id, batch_size)
+            ).fetchall()
+            if not rows:
+                break
+            with conn:
+                conn.executemany(
+                    f"INSERT INTO {table}_fts (rowid, title, body) VALUES (?, ?, ?)",
+                    [(row_id, title or "", html_to_text(decompress_html(db_path, html))) for row_id, title, html in rows]
+                )
+            done += len(rows)
+            last_id = rows[-1][0]
+        with conn:
+            conn.execute(f"INSERT INTO {table}_fts ({table}_fts) VALUES ('optimize')")
+        print(f"{db_path} [{table}]: indexed {done} new row(s).")
+
+
+def search(db_paths, query, limit=20):
+    """Returns up to `limit` best hits over all databases as (book, chapter, url, snippet, score)."""
+    hits = []
+    for db_path in db_paths:
+        if not os.path.exists(db_path):
+            continue
+        conn = connect(db_path)
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        for table, sql in SEARCH_SQL.items():
+            if f"{table}_fts" not in indexes:
+                continue
+            try:
+                hits.extend(conn.execute(sql, (query, limit)).fetchall())
+            except sqlite3.OperationalError:
+                # Not valid FTS5 syntax (stray quotes, colons...): search the words as plain terms
+                terms = " ".join('"' + word.replace('"', '""') + '"' for word in query.split())
+                hits.extend(conn.execute(sql, (terms, limit)).fetchall())
+    # bm25 scores are lower-is-better and comparable enough across similar corpora
+    return sorted(hits, key=lambda hit: hit[4])[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Full-text search over the stored chapters and articles.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    find = commands.add_parser("search", help="Ranked passages matching an FTS5 query")
+    find.add_argument("query", help='Words, "exact phrases", prefix*, AND/OR/NOT, NEAR(a b, 5)')
+    find.add_argument("--limit", type=int, default=20, help="Hits to show (default 20)")
+    find.add_argument("--db", action="append", dest="db_paths", help="Database to search (default: both)")
+    build = commands.add_parser("rebuild", help="Index rows stored before the index existed")
+    build.add_argument("db_paths", nargs="*", help="Database files (default: both)")
+    args = parser.parse_args()
+
+    db_paths = [os.path.expanduser(path) for path in (args.db_paths or DEFAULT_DBS)]
+    if args.command == "rebuild":
+        for db_path in db_paths:
+            rebuild(db_path)
+    elif args.command == "search":
+        hits = search(db_paths, args.query, args.limit)
+        if not hits:
+            print("No matches. Run 'python3 fulltext.py rebuild' if older chapters were never indexed.")
+        for book, chapter, url, snippet, _ in hits:
+            print(f"\n{book} - {chapter}\n  {url}\n  {' '.join(snippet.split())}")
+
+
+if __name__ == "__main__":
+    main()
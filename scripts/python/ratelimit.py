@@ -0,0 +1,171 @@
+import atexit
+import email.utils
+import json
+import os
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+DEFAULT_STATE_PATH = os.path.expanduser("~/github/knowledge/host_limits.json")
+THROTTLE_STATUSES = (429, 503)
+# Longest a host is paused for, whether computed or asked for with Retry-After
+MAX_PAUSE = 300.0
+
+
+def parse_retry_after(value):
+    """Converts a Retry-After header (seconds or HTTP date) to seconds, or None."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+class HostRateLimiter:
+    """Token-bucket rate limiter keyed by host that adapts to how each host responds.
+
+    Every host starts at `initial_rate` requests per second. Fast, healthy
+    responses raise the rate additively up to `max_rate`; slow ones lower it a
+    little; 429/503 and connection failures halve it and pause the host with
+    jittered exponential backoff, or for Retry-After when the server sends
+    one. No pause lasts longer than `max_pause` seconds. Learned rates and
+    pending pauses are saved to `state_path` on exit and reused by the next
+    run. Safe to share between threads.
+    """
+
+    def __init__(self, state_path=DEFAULT_STATE_PATH, initial_rate=1 / 1.5, min_rate=0.05, max_rate=2.0,
+                 fast_seconds=1.0, slow_seconds=5.0, max_pause=MAX_PAUSE):
+        self.state_path = state_path
+        self.initial_rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.fast_seconds = fast_seconds
+        self.slow_seconds = slow_seconds
+        self.max_pause = max_pause
+        self.hosts = {}
+        self.lock = threading.Lock()
+        self._load()
+        atexit.register(self.save)
+
+    def _host(self, url):
+        """Returns the mutable state of the host of `url`; call with the lock held."""
+        host = urlparse(url).netloc
+        state = self.hosts.get(host)
+        if state is None:
+            state = self.hosts[host] = {"rate": self.initial_rate, "failures": 0, "paused_until": 0.0}
+        state.setdefault("tokens", 1.0)
+        state.setdefault("refilled", time.monotonic())
+        return state
+
+    def wait(self, url):
+        """Blocks until a request to the host of `url` may be sent, then consumes a token.
+
+        Returns the seconds spent waiting.
+        """
+        start = time.monotonic()
+        while True:
+            with self.lock:
+                state = self._host(url)
+                now = time.monotonic()
+                pause = state["paused_until"] - time.time()
+                if pause > 0 and state.pop("loaded_pause", False):
+                    print(f"  [Debug] {urlparse(url).netloc} is still paused from an earlier run; waiting {pause:.0f}s.")
+                if pause <= 0:
+                    # Burst capacity of one request: the bucket never holds more than a token
+                    state["tokens"] = min(1.0, state["tokens"] + (now - state["refilled"]) * state["rate"])
+                    state["refilled"] = now
+                    if state["tokens"] >= 1.0:
+                        state["tokens"] -= 1.0
+                        return time.monotonic() - start
+                    pause = (1.0 - state["tokens"]) / state["rate"]
+            time.sleep(pause)
+
+    def record(self, url, status, elapsed, retry_after=None):
+        """Feeds back one response: HTTP `status` (None for a network failure) after `elapsed` seconds."""
+        with self.lock:
+            state = self._host(url)
+            if status is None or status in THROTTLE_STATUSES:
+                state["failures"] += 1
+                state["rate"] = max(self.min_rate, state["rate"] / 2)
+                delay = parse_retry_after(retry_after)
+                if delay is None:
+                    delay = min(self.max_pause, 2.0 ** state["failures"] * random.uniform(0.5, 1.5))
+                elif delay > self.max_pause:
+                    print(f"  [Warning] {urlparse(url).netloc} asks to wait {delay:.0f}s; waiting {self.max_pause:.0f}s instead.")
+                    delay = self.max_pause
+                state["paused_until"] = time.time() + delay
+                print(f"  [Warning] {urlparse(url).netloc} is throttling or failing; backing off {delay:.0f}s.")
+            else:
+                state["failures"] = 0
+                if elapsed <= self.fast_seconds and status < 400:
+                    state["rate"] = min(self.max_rate, state["rate"] + 0.05)
+                elif elapsed >= self.slow_seconds:
+                    state["rate"] = max(self.min_rate, state["rate"] * 0.9)
+
+    def _load(self):
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        for host, state in saved.items():
+            # Files from before pauses were capped may hold much longer ones
+            paused_until = min(state.get("paused_until", 0.0), now + self.max_pause)
+            self.hosts[host] = {
+                "rate": min(self.max_rate, max(self.min_rate, state.get("rate", self.initial_rate))),
+                "failures": state.get("failures", 0),
+                "paused_until": paused_until,
+                "loaded_pause": paused_until > now,
+            }
+
+    def save(self):
+        """Writes each host's learned rate and any pending pause to `state_path`."""
+        with self.lock:
+            saved = {
+                host: {"rate": round(state["rate"], 4), "failures": state["failures"], "paused_until": state["paused_until"]}
+                for host, state in self.hosts.items()
+            }
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(saved, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.state_path)
+
+
+def polite_get(limiter, url, session=None, attempts=3, stats=None, **kwargs):
+    """requests GET paced by `limiter`, retrying throttled or failed requests.
+
+    Returns the last response; raises the last network error if every attempt failed.
+    A `stats` dict, if given, receives the seconds spent in "pacing" and "fetch"
+    and the number of "retries".
+    """
+    import requests
+
+    if stats is None:
+        stats = {}
+    stats.update(pacing=0.0, fetch=0.0, retries=0)
+    http = session or requests
+    for attempt in range(attempts):
+        stats["retries"] = attempt
+        stats["pacing"] += limiter.wait(url)
+        start = time.monotonic()
+        try:
+            response = http.get(url, **kwargs)
+        except requests.RequestException:
+            stats["fetch"] += time.monotonic() - start
+            limiter.record(url, None, time.monotonic() - start)
+            if attempt == attempts - 1:
+                raise
+            continue
+        stats["fetch"] += time.monotonic() - start
+        limiter.record(url, response.status_code, time.monotonic() - start, response.headers.get("Retry-After"))
+        if response.status_code not in THROTTLE_STATUSES:
+            break
+    return response
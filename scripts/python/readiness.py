@@ -0,0 +1,107 @@
+import itertools
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict, deque
+from urllib.parse import urlparse
+
+# Upper bounds (seconds) of the readiness histogram buckets; the last one catches the rest
+BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 15, 30, float("inf"))
+
+# Resolves once `selector` is attached with non-empty text that has not changed for
+# `stable` ms. State lives on window keyed by a per-call token, so a reused page
+# (SPA navigation) never inherits the previous chapter's measurements.
+STABLE_TEXT_JS = """
+([selector, stable, token]) => {
+    const el = document.querySelector(selector);
+    if (!el) return false;
+    const length = el.textContent.length;
+    const now = performance.now();
+    const state = window.__crawlerReadiness;
+    if (!state || state.token !== token || state.length !== length) {
+        window.__crawlerReadiness = {token, length, since: now};
+        return false;
+    }
+    return length > 0 && now - state.since >= stable;
+}
+"""
+
+_tokens = itertools.count()
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Readiness:
+    """Waits for chapter content to settle and learns how long each host takes.
+
+    Timeouts start at `default_timeout` and, once a host has `min_samples`
+    measurements, become a multiple of its p95 readiness time clamped to
+    [`min_timeout`, `max_timeout`]. Every wait also lands in a per-host
+    histogram printed by report(). Safe to share between threads.
+    """
+
+    def __init__(self, default_timeout=15.0, min_timeout=3.0, max_timeout=30.0, min_samples=10, stable_ms=300):
+        self.default_timeout = default_timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.min_samples = min_samples
+        self.stable_ms = stable_ms
+        self.samples = defaultdict(lambda: deque(maxlen=200))  # host -> recent successful wait times
+        self.histogram = defaultdict(lambda: [0] * len(BUCKETS))  # (host, kind) -> bucket counts
+        self.timeouts = defaultdict(int)  # (host, kind) -> waits that gave up
+        self.lock = threading.Lock()
+
+    def timeout(self, url):
+        """Seconds to wait for content on the host of `url` before giving up."""
+        with self.lock:
+            samples = self.samples.get(urlparse(url).netloc)
+            if not samples or len(samples) < self.min_samples:
+                return self.default_timeout
+            return min(self.max_timeout, max(self.min_timeout, 3 * percentile(samples, 0.95)))
+
+    def wait(self, page, url, selector, kind="content"):
+        """Returns once `selector` holds stable text; raises on timeout like wait_for_selector.
+
+        `kind` only labels the histogram ("content" for new chapters, "advance"
+        for pages loaded just to find the 'Next' link).
+        """
+        limit = self.timeout(url)
+        start = time.monotonic()
+        try:
+            page.wait_for_function(
+                STABLE_TEXT_JS, arg=[selector, self.stable_ms, next(_tokens)], polling=100, timeout=limit * 1000
+            )
+        except Exception:
+            self._record(url, kind, time.monotonic() - start, ok=False)
+            raise
+        self._record(url, kind, time.monotonic() - start, ok=True)
+
+    def _record(self, url, kind, elapsed, ok):
+        host = urlparse(url).netloc
+        with self.lock:
+            self.histogram[(host, kind)][bisect_left(BUCKETS, elapsed)] += 1
+            if ok:
+                self.samples[host].append(elapsed)
+            else:
+                self.timeouts[(host, kind)] += 1
+
+    def report(self):
+        """Prints the readiness-wait histogram per host and kind of wait."""
+        with self.lock:
+            rows = sorted(self.histogram.items())
+            if not rows:
+                return
+            labels = [f"<={b:g}s" for b in BUCKETS[:-1]] + [f">{BUCKETS[-2]:g}s"]
+            print("\nBrowser readiness waits:")
+            print(f"  {'host':<30} {'kind':<8} " + " ".join(f"{label:>7}" for label in labels) + "  timeouts  p50     p95")
+            for (host, kind), counts in rows:
+                samples = self.samples.get(host)
+                p50 = f"{percentile(samples, 0.5):.2f}s" if samples else "-"
+                p95 = f"{percentile(samples, 0.95):.2f}s" if samples else "-"
+                print(
+                    f"  {host[:30]:<30} {kind:<8} " + " ".join(f"{c:>7}" for c in counts)
+                    + f"  {self.timeouts[(host, kind)]:>8}  {p50:<7} {p95}"
+                )
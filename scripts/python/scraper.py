@@ -1,7 +1,9 @@
-import requests
 from bs4 import BeautifulSoup
-import time
+from ratelimit import HostRateLimiter, polite_get
 
+# Per-host pacing that speeds up on healthy sites and backs off on 429/503
+LIMITER = HostRateLimiter()
+HEADERS = {"User-Agent": "Mozilla/5.0"}
 
 
 def scrape_pages():
@@ -17,7 +19,7 @@ def scrape_pages():
 
         try:
             # 1. Fetch the page
-            response = requests.get(url, headers={"User-Agent": "Mozilla/5.0"})
+            response = polite_get(LIMITER, url, headers=HEADERS)
             if response.status_code != 200:
                 print(f"Skipping {i}: Status code {response.status_code}")
                 continue
@@ -34,9 +36,6 @@ def scrape_pages():
                 with open("scraped_content.txt", "a", encoding="utf-8") as f:
                     f.write(text_data)
 
-            # 4. Respectful delay (prevents getting blocked)
-            time.sleep(1)
-
         except Exception as e:
             print(f"Error on page {i}: {e}")
 
@@ -55,7 +54,7 @@ def scrape_from_toc():
 
     def fetch_page(url):
         print(f"Fetching TOC: {url}")
-        response = requests.get(url, headers={"User-Agent": "Mozilla/5.0"})
+        response = polite_get(LIMITER, url, headers=HEADERS)
         if response.status_code != 200:
             print(f"Failed to fetch TOC: {response.status_code}")
             return None
@@ -78,7 +77,6 @@ def scrape_from_toc():
 
         next_url = base_url + next_href if next_href.startswith("/") else next_href
         soup = fetch_page(next_url)
-        time.sleep(1)
 
     print(f"Total links collected: {len(all_links)}")
 
@@ -90,7 +88,7 @@ def scrape_from_toc():
         full_href = base_url.rstrip("/") + href if href.startswith("/") else href
         print(f"Scraping: {full_href}")
         try:
-            page_response = requests.get(full_href, headers={"User-Agent": "Mozilla/5.0"})
+            page_response = polite_get(LIMITER, full_href, headers=HEADERS)
             if page_response.status_code != 200:
                 print(f"Skipped {full_href}: Status {page_response.status_code}")
                 continue
@@ -106,8 +104,6 @@ def scrape_from_toc():
             else:
                 print(f"  -> No content found")
 
-            time.sleep(1)
-
         except Exception as e:
             print(f"Error on {full_href}: {e}")
 
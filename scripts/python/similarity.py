@@ -0,0 +1,102 @@
+import hashlib
+import re
+from collections import deque
+
+BITS = 64
+# Fingerprints this many bits apart or fewer count as the same page. Unrelated
+# pages sit around 32 bits apart, rarely below 20.
+NEAR_DISTANCE = 12
+# Below this many words a page is fingerprinted by character 4-grams rather than
+# word triples: notices differ in a word or two, which would break most triples
+SHORT_TEXT_WORDS = 150
+
+# Text of pages sites serve instead of a chapter; matched after cleaning, like any chapter
+PLACEHOLDER_TEXTS = (
+    "This chapter is locked. Unlock it to continue reading.",
+    "This chapter is locked. Please log in or purchase coins to unlock this chapter.",
+    "You must be logged in to read this chapter. Log in or sign up to continue reading.",
+    "Please log in to continue reading.",
+    "Chapter not found. The chapter you are looking for does not exist or has been removed.",
+    "This chapter is not available yet. Please check back later.",
+    "Coming soon. This chapter has not been released yet.",
+    "Access denied. You do not have permission to view this page.",
+    "404 Not Found. The requested page could not be found.",
+    "Please enable JavaScript and cookies to continue.",
+    "Checking your browser before accessing the website.",
+    "Just a moment... Verifying you are human. This may take a few seconds.",
+)
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+_DIGITS = re.compile(r"\d+")
+
+
+def simhash(text):
+    """64-bit simhash of `text`, as a signed integer (fits SQLite INTEGER).
+
+    Texts that share most of their wording get fingerprints a few bits apart;
+    see distance(). Chapters are hashed over word triples, which different
+    chapters of one book rarely share even though their vocabulary is the same.
+    """
+    # Numbers are masked: notices differ mostly in the chapter number, price or date
+    words = _WORD.findall(_DIGITS.sub("0", text.lower()))
+    if len(words) < SHORT_TEXT_WORDS:
+        joined = " ".join(words)
+        shingles = {joined[i:i + 4] for i in range(max(1, len(joined) - 3))}
+    else:
+        shingles = {" ".join(words[i:i + 3]) for i in range(len(words) - 2)}
+    weights = [0] * BITS
+    for shingle in shingles:
+        value = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(BITS):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    fingerprint = sum(1 << bit for bit in range(BITS) if weights[bit] > 0)
+    return fingerprint - (1 << BITS) if fingerprint >= 1 << (BITS - 1) else fingerprint
+
+
+def distance(first, second):
+    """Number of differing bits between two fingerprints."""
+    return bin((first ^ second) & ((1 << BITS) - 1)).count("1")
+
+
+PLACEHOLDERS = [simhash(text) for text in PLACEHOLDER_TEXTS]
+
+
+def near_placeholder(fingerprint, placeholders=()):
+    """True if `fingerprint` is near a built-in placeholder page or one of `placeholders`."""
+    return any(distance(fingerprint, known) <= NEAR_DISTANCE for known in PLACEHOLDERS + list(placeholders))
+
+
+class RepeatDetector:
+    """Spots a site serving the same page (a lock notice, login wall, error) as chapter after chapter.
+
+    check() takes each new chapter's fingerprint in reading order. A chapter
+    is suspect when it is near a known placeholder, or when it and one of the
+    last `window` chapters are near each other (both become suspect). The
+    pattern is confirmed once `limit` of the last `window` chapters are
+    suspect. Seed `recent` with the book's last stored (fingerprint, key)
+    pairs so short runs still see the pattern.
+    """
+
+    def __init__(self, placeholders=(), recent=(), window=6, limit=3):
+        self.placeholders = list(placeholders)
+        self.recent = deque(([value, key, False] for value, key in recent), maxlen=window)  # [fingerprint, key, suspect]
+        self.limit = limit
+
+    def check(self, fingerprint, key=None):
+        """Returns (placeholder, confirmed) for a new chapter.
+
+        `placeholder` is True when it is near a known placeholder page.
+        `confirmed` lists the keys of the recent suspect chapters, this one
+        included, once there are `limit` of them; otherwise it is empty.
+        """
+        placeholder = near_placeholder(fingerprint, self.placeholders)
+        suspect = placeholder
+        for entry in self.recent:
+            # A chapter fetched again is not compared with its own earlier copy
+            if key is not None and entry[1] == key:
+                continue
+            if distance(fingerprint, entry[0]) <= NEAR_DISTANCE:
+                entry[2] = suspect = True
+        self.recent.append([fingerprint, key, suspect])
+        confirmed = [entry[1] for entry in self.recent if entry[2]]
+        return placeholder, confirmed if len(confirmed) >= self.limit else []
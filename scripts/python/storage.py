@@ -0,0 +1,275 @@
+import argparse
+import os
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # Optional: fall back to zlib when python-zstandard is missing
+    zstandard = None
+
+# One long-lived connection per (thread, database file)
+_local = threading.local()
+
+# First byte of a compressed html_content blob; legacy rows are plain TEXT
+CODEC_ZLIB = b"z"
+CODEC_ZSTD = b"s"
+CODEC_ZSTD_DICT = b"d"  # followed by the 4-byte compression_dicts.id
+ZSTD_LEVEL = 9
+DICT_SIZE = 112 * 1024
+
+# Trained dictionaries never change once stored, so they are cached for good
+_dicts = {}  # (db_path, dict_id) -> zstandard.ZstdCompressionDict
+_scope_dicts = {}  # (db_path, scope) -> newest dict_id, or None
+
+
+def connect(db_path):
+    """Returns this thread's long-lived connection to `db_path`, opened in WAL mode.
+
+    Connections are cached, so calling this for every query is cheap. Using the
+    connection as a context manager (`with connect(path) as conn:`) commits on
+    exit without closing it, the same as a fresh `sqlite3.connect`.
+    """
+    connections = _local.__dict__.setdefault("connections", {})
+    conn = connections.get(db_path)
+    if conn is None:
+        conn = sqlite3.connect(db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # NORMAL is durable in WAL mode and skips an fsync per commit
+        conn.execute("PRAGMA synchronous=NORMAL")
+        connections[db_path] = conn
+    return conn
+
+
+def close_all():
+    """Closes every connection opened by the current thread."""
+    connections = _local.__dict__.pop("connections", {})
+    for conn in connections.values():
+        conn.close()
+
+
+def add_column(conn, table, column, definition):
+    """Adds `column` to `table` unless it already exists (lightweight migration)."""
+    try:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    except sqlite3.OperationalError:
+        pass  # Column already exists
+
+
+class BatchWriter:
+    """Queues write statements and runs them in one transaction per batch.
+
+    A batch is flushed once it holds `batch_size` statements or its oldest entry
+    is `max_delay` seconds old, so the write lock is only held briefly and other
+    crawler threads are not starved. Use it as a context manager to flush on exit.
+    """
+
+    def __init__(self, conn, batch_size=20, max_delay=10.0):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.pending = []
+        self.first_queued = None
+
+    def add(self, sql, params=()):
+        if not self.pending:
+            self.first_queued = time.monotonic()
+        self.pending.append((sql, params))
+        if len(self.pending) >= self.batch_size or time.monotonic() - self.first_queued >= self.max_delay:
+            self.flush()
+
+    def flush(self):
+        """Commits the queued statements; a batch that fails is not retried by later flushes.
+
+        When a statement breaks a constraint, the batch is run again one
+        statement at a time and only the offending ones are dropped.
+        """
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        try:
+            with self.conn:
+                for sql, params in batch:
+                    self.conn.execute(sql, params)
+        except sqlite3.IntegrityError:
+            for sql, params in batch:
+                try:
+                    with self.conn:
+                        self.conn.execute(sql, params)
+                except sqlite3.IntegrityError as e:
+                    print(f"  [Warning] Dropped a write that failed ({e}): {' '.join(sql.split())[:80]}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+
+def _ensure_dict_table(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS compression_dicts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            scope TEXT,
+            data BLOB,
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def _load_dict(db_path, dict_id):
+    key = (db_path, dict_id)
+    if key not in _dicts:
+        row = connect(db_path).execute("SELECT data FROM compression_dicts WHERE id = ?", (dict_id,)).fetchone()
+        if row is None:
+            raise ValueError(f"Compression dictionary {dict_id} is missing from {db_path}")
+        _dicts[key] = zstandard.ZstdCompressionDict(row[0])
+    return _dicts[key]
+
+
+def _scope_dict_id(db_path, scope):
+    key = (db_path, scope)
+    if key not in _scope_dicts:
+        conn = connect(db_path)
+        _ensure_dict_table(conn)
+        row = conn.execute(
+            "SELECT id FROM compression_dicts WHERE scope = ? ORDER BY id DESC LIMIT 1", (scope,)
+        ).fetchone()
+        _scope_dicts[key] = row[0] if row else None
+    return _scope_dicts[key]
+
+
+def compress_html(db_path, html, scope=None):
+    """Compresses an HTML body for storage in `db_path`.
+
+    Uses zstd (with the dictionary trained for `scope`, e.g. "book:12", if any)
+    when python-zstandard is installed, zlib otherwise.
+    """
+    data = html.encode("utf-8")
+    if zstandard is None:
+        return CODEC_ZLIB + zlib.compress(data, 6)
+    dict_id = _scope_dict_id(db_path, scope) if scope else None
+    if dict_id is None:
+        return CODEC_ZSTD + zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=_load_dict(db_path, dict_id))
+    return CODEC_ZSTD_DICT + struct.pack(">I", dict_id) + compressor.compress(data)
+
+
+def decompress_html(db_path, value):
+    """Returns the HTML text of a stored body, compressed or not."""
+    if value is None or isinstance(value, str):
+        return value
+    codec, payload = value[:1], value[1:]
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(payload).decode("utf-8")
+    if zstandard is None:
+        raise RuntimeError("This database holds zstd-compressed rows; install python-zstandard to read them.")
+    if codec == CODEC_ZSTD:
+        return zstandard.ZstdDecompressor().decompress(payload).decode("utf-8")
+    if codec == CODEC_ZSTD_DICT:
+        (dict_id,) = struct.unpack(">I", payload[:4])
+        decompressor = zstandard.ZstdDecompressor(dict_data=_load_dict(db_path, dict_id))
+        return decompressor.decompress(payload[4:]).decode("utf-8")
+    raise ValueError(f"Unknown html_content codec {codec!r}")
+
+
+def train_dict(db_path, scope, samples):
+    """Trains and stores a zstd dictionary for `scope` from sample HTML bodies.
+
+    Returns the new dictionary id, or None if zstd is unavailable or there are
+    too few samples to learn from.
+    """
+    if zstandard is None or len(samples) < 20:
+        return None
+    try:
+        trained = zstandard.train_dictionary(DICT_SIZE, [s.encode("utf-8") for s in samples])
+    except zstandard.ZstdError as e:
+        print(f"  [Warning] Could not train a dictionary for {scope}: {e}")
+        return None
+    with connect(db_path) as conn:
+        _ensure_dict_table(conn)
+        dict_id = conn.execute(
+            "INSERT INTO compression_dicts (scope, data) VALUES (?, ?)", (scope, trained.as_bytes())
+        ).lastrowid
+    _scope_dicts[(db_path, scope)] = dict_id
+    return dict_id
+
+
+# Tables holding html_content, and the column that groups rows into one dictionary scope
+COMPRESSIBLE_TABLES = {"chapters": "book_id", "articles": None}
+
+
+def migrate_compress(db_path, train=False, batch_size=200):
+    """Compresses every still-uncompressed html_content row of `db_path` in place.
+
+    With `train`, a zstd dictionary is trained per book (or one for all articles)
+    first, so the many small bodies share their repetitive markup.
+    """
+    conn = connect(db_path)
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    before = os.path.getsize(db_path)
+
+    for table, group_column in COMPRESSIBLE_TABLES.items():
+        if table not in tables:
+            continue
+        group_expr = group_column or "NULL"
+        groups = [row[0] for row in conn.execute(f"SELECT DISTINCT {group_expr} FROM {table}")]
+        for group in groups:
+            scope = f"book:{group}" if group_column else table
+            where = f"{group_column} = ?" if group_column else "1 = 1"
+            params = (group,) if group_column else ()
+
+            if train and _scope_dict_id(db_path, scope) is None:
+                samples = [
+                    decompress_html(db_path, row[0]) for row in conn.execute(
+                        f"SELECT html_content FROM {table} WHERE {where} AND html_content IS NOT NULL "
+                        "ORDER BY RANDOM() LIMIT 500", params
+                    )
+                ]
+                if train_dict(db_path, scope, samples):
+                    print(f"Trained dictionary for {scope} from {len(samples)} samples.")
+
+            # Compressed rows stop matching typeof = 'text', so each pass picks up the next batch
+            done = 0
+            while True:
+                rows = conn.execute(
+                    f"SELECT id, html_content FROM {table} WHERE {where} AND typeof(html_content) = 'text' LIMIT ?",
+                    params + (batch_size,)
+                ).fetchall()
+                if not rows:
+                    break
+                with BatchWriter(conn, batch_size=batch_size) as writer:
+                    for row_id, html in rows:
+                        writer.add(
+                            f"UPDATE {table} SET html_content = ? WHERE id = ?",
+                            (compress_html(db_path, html, scope), row_id)
+                        )
+                done += len(rows)
+            if done:
+                print(f"{table} [{scope}]: compressed {done} rows.")
+
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.execute("VACUUM")
+    after = os.path.getsize(db_path)
+    print(f"{db_path}: {before / 1e6:.1f} MB -> {after / 1e6:.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintenance commands for the knowledge databases.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    compress = commands.add_parser("compress", help="Compress stored HTML bodies in place")
+    compress.add_argument("db_paths", nargs="+", help="Database files, e.g. ~/github/knowledge/novels_digest.db")
+    compress.add_argument("--train-dicts", action="store_true", help="Train a zstd dictionary per book first")
+    args = parser.parse_args()
+
+    if args.command == "compress":
+        for db_path in args.db_paths:
+            migrate_compress(os.path.expanduser(db_path), train=args.train_dicts)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Query parameters that never change which chapter a URL shows
+IGNORED_PARAMS = {
+    "view_adult",  # AO3's adult-content switch, added by the crawler itself
+    "fbclid", "gclid", "dclid", "msclkid", "yclid", "igshid", "mc_cid", "mc_eid",
+    "ref", "ref_src", "source", "share", "_ga", "spm",
+}
+IGNORED_PREFIXES = ("utm_",)
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def canonical_url(url):
+    """Reduces a chapter URL to the form used to recognise it again.
+
+    Lowercases scheme and host, drops "www.", default ports, fragments, the
+    trailing slash and tracking or view-only parameters, and sorts what is left
+    of the query. http and https count as the same page. Two URLs with the same
+    canonical form are treated as the same chapter.
+    """
+    if not url:
+        return url
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    netloc = host
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        netloc = f"{host}:{parts.port}"
+    if scheme == "http":
+        scheme = "https"
+
+    path = parts.path or "/"
+    while "//" in path:
+        path = path.replace("//", "/")
+    if len(path) > 1:
+        path = path.rstrip("/")
+
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key.lower() not in IGNORED_PARAMS and not key.lower().startswith(IGNORED_PREFIXES)
+    )
+    return urlunsplit((scheme, netloc, path, urlencode(query), ""))
+
+
+def same_page(first, second):
+    """True if both URLs canonicalise to the same page."""
+    return canonical_url(first) == canonical_url(second)